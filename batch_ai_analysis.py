@@ -0,0 +1,191 @@
+"""
+Headless batch AI analysis for the whole practice.
+
+Finds clinical records that have a transcription but no AI analysis and
+analyzes them with analyze_transcription(), a bounded number at a time.
+Progress is checkpointed in the data_backfills table after every record, so
+an interrupted run picks up where it stopped. Run from the directory that
+holds data/dentai.db:
+
+    OPENAI_API_KEY=sk-... python batch_ai_analysis.py --concurrency 2
+
+Records whose analysis fails are skipped and counted; run again with
+--restart to retry them.
+
+The app's OpenAI rate limits are per process. This batch gets its own, and
+the running app does not see the batch's requests, so together they can
+exceed the account's requests or tokens per minute. Keep --concurrency low
+while the practice is using the app, or run the batch out of hours.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import streamlit_cloud_app as app
+
+CHECKPOINT_NAME = "batch:ai_analysis"
+# Which of app.ANALYSIS_MODELS is saved as the record's ai_analysis
+BATCH_MODEL_KEYS = {key: (key, model, label) for key, model, label in app.ANALYSIS_MODELS}
+
+
+def pending_records(pool, after_id, limit):
+    """Clinical records after after_id with a transcription and no analysis, in id order."""
+    return pool.query(
+        """SELECT cr.id, cr.patient_id, cr.transcription, p.first_name || ' ' || p.last_name
+        FROM clinical_records cr JOIN patients p ON cr.patient_id = p.id
+        WHERE cr.id > ? AND cr.transcription IS NOT NULL AND cr.transcription != '' AND cr.ai_analysis IS NULL
+        ORDER BY cr.id LIMIT ?""",
+        (after_id, limit)
+    )
+
+
+def load_checkpoint(pool):
+    row = pool.query_one("SELECT last_id FROM data_backfills WHERE name = ?", (CHECKPOINT_NAME,))
+    return row[0] if row else 0
+
+
+def save_checkpoint(pool, last_id):
+    pool.execute(
+        "INSERT INTO data_backfills (name, last_id) VALUES (?, ?) "
+        "ON CONFLICT(name) DO UPDATE SET last_id = excluded.last_id",
+        (CHECKPOINT_NAME, last_id)
+    )
+
+
+def analyze_record(client, record, model_entry, structured):
+    """
+    Analyze one clinical record and save the report (and structured fields).
+
+    Returns:
+        (seconds taken, transcript characters)
+    """
+    record_id, patient_id, transcription, patient_name = record
+    key, model, label = model_entry
+    started = time.monotonic()
+    outcome = app.analyze_transcription(
+        client, transcription, patient_id, patient_name, models=[model_entry],
+        structured=structured, requester="batch"
+    )
+    if key in outcome.failures:
+        raise RuntimeError(outcome.failures[key])
+
+    analysis = outcome.reports[key] + f"\n\n*This analysis was generated by {label}.*"
+    # Only fill records that are still empty, so an analysis saved from the app meanwhile wins
+    saved = app.get_db_pool().execute(
+        "UPDATE clinical_records SET ai_analysis = ? WHERE id = ? AND ai_analysis IS NULL",
+        (analysis, record_id)
+    ).rowcount
+    # If the app saved an analysis meanwhile, its record keeps the fields that go with it
+    if saved and outcome.fields:
+        app.save_clinical_fields(record_id, outcome.fields, app.CLINICAL_EXTRACTION_MODEL)
+    return time.monotonic() - started, len(transcription)
+
+
+def run_batch(api_key, concurrency=2, limit=None, model_key="gpt4", structured=True, restart=False, batch_size=100):
+    """
+    Analyze every pending record and print progress and throughput.
+
+    At most concurrency records are in flight at once, within this process's
+    per-model rate limits; a running app has its own, separate limits. The
+    checkpoint only moves past a record once it and every record before it
+    have finished, so an interruption never skips unprocessed records.
+
+    Returns:
+        (records analyzed, records failed)
+    """
+    app.init_db()
+    pool = app.get_db_pool()
+    client = app.get_openai_client(api_key)
+    connected, error_message = app.get_api_health_probe().check(api_key)
+    if not connected:
+        raise SystemExit(f"Cannot reach the OpenAI API: {error_message}")
+
+    if restart:
+        save_checkpoint(pool, 0)
+    last_id = load_checkpoint(pool)
+    print(f"Resuming after clinical record {last_id}" if last_id else "Starting from the first clinical record")
+
+    model_entry = BATCH_MODEL_KEYS[model_key]
+    analyzed = failed = characters = 0
+    latencies = []
+    started = time.monotonic()
+    in_flight = {}  # future -> record id
+    scanned_id = last_id
+    exhausted = False
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="dentai-batch") as executor:
+        try:
+            while in_flight or not exhausted:
+                # Keep the executor full without reading the whole backlog into memory
+                while not exhausted and len(in_flight) < concurrency and (limit is None or analyzed + failed + len(in_flight) < limit):
+                    records = pending_records(pool, scanned_id, min(batch_size, concurrency - len(in_flight)))
+                    if not records:
+                        exhausted = True
+                        break
+                    for record in records:
+                        in_flight[executor.submit(analyze_record, client, record, model_entry, structured)] = record[0]
+                        scanned_id = record[0]
+                if limit is not None and analyzed + failed + len(in_flight) >= limit:
+                    exhausted = True
+                if not in_flight:
+                    break
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    record_id = in_flight.pop(future)
+                    try:
+                        seconds, chars = future.result()
+                        analyzed += 1
+                        characters += chars
+                        latencies.append(seconds)
+                    except Exception as e:
+                        failed += 1
+                        print(f"Record {record_id} failed: {e}")
+
+                # Everything before the oldest record still in flight is finished
+                checkpoint = min(in_flight.values()) - 1 if in_flight else scanned_id
+                save_checkpoint(pool, checkpoint)
+
+                elapsed = time.monotonic() - started
+                print(f"{analyzed} analyzed, {failed} failed, {len(in_flight)} in flight, "
+                      f"{60 * analyzed / elapsed:.1f} records/min")
+        except KeyboardInterrupt:
+            print("Interrupted; finishing the records in flight. The next run resumes from the checkpoint.")
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    elapsed = time.monotonic() - started
+    print(f"Done in {elapsed:.0f}s: {analyzed} analyzed, {failed} failed")
+    if analyzed:
+        latencies.sort()
+        print(f"Throughput: {60 * analyzed / elapsed:.1f} records/min, {characters / elapsed:.0f} transcript chars/s")
+        print(f"Latency per record: median {latencies[len(latencies) // 2]:.1f}s, "
+              f"p95 {latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]:.1f}s")
+    return analyzed, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyze all clinical records that have a transcription but no AI analysis.")
+    parser.add_argument("--api-key", default=os.environ.get("OPENAI_API_KEY"), help="OpenAI API key (default: $OPENAI_API_KEY)")
+    parser.add_argument("--concurrency", type=int, default=2, help="records analyzed at once (default: 2)")
+    parser.add_argument("--limit", type=int, help="stop after this many records")
+    parser.add_argument("--model", choices=sorted(BATCH_MODEL_KEYS), default="gpt4", help="report saved as the analysis (default: gpt4)")
+    parser.add_argument("--no-structured", action="store_true", help="skip structured clinical field extraction")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and rescan every record")
+    args = parser.parse_args(argv)
+
+    if not args.api_key:
+        parser.error("an OpenAI API key is required (--api-key or $OPENAI_API_KEY)")
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+
+    analyzed, failed = run_batch(
+        args.api_key, concurrency=args.concurrency, limit=args.limit, model_key=args.model,
+        structured=not args.no_structured, restart=args.restart
+    )
+    return 1 if failed and not analyzed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
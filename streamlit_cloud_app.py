@@ -4,14 +4,25 @@ import os
 import time
 import re
 import json
+import shutil
+import subprocess
 import ast
+import atexit
 import hashlib
-from datetime import datetime, date, timedelta
+import queue
+import threading
+import unicodedata
+import uuid
+import wave
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from contextlib import closing, contextmanager
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, date, timedelta, timezone
 import pandas as pd
 import numpy as np
 from io import BytesIO
 import base64
-import requests
 
 # Import streamlit-mic-recorder for browser-based audio recording
 try:
@@ -24,7 +35,6 @@ except ImportError:
 # Try to import audio recording libraries
 try:
     import pyaudio
-    import wave
     PYAUDIO_AVAILABLE = True
 except ImportError:
     PYAUDIO_AVAILABLE = False
@@ -38,8 +48,15 @@ try:
 except ImportError:
     PDF_EXPORT_AVAILABLE = False
 
+# Exact token counts for splitting long transcripts; estimated from length without it
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
 # OpenAI for AI analysis
-from openai import OpenAI
+from openai import APIConnectionError, APIStatusError, OpenAI
 
 # Initialize session state variables if they don't exist
 if 'logged_in' not in st.session_state:
@@ -72,14 +89,119 @@ if 'transcription_complete' not in st.session_state:
     st.session_state.transcription_complete = False
 
 # Database setup
-def init_db():
-    # Ensure data directory exists
-    os.makedirs('data', exist_ok=True)
+DB_PATH = os.path.join('data', 'dentai.db')
+
+class ConnectionPool:
+    """
+    Process-wide pool of SQLite connections shared by every Streamlit session.
     
-    # Connect to database
-    conn = sqlite3.connect('data/dentai.db')
-    c = conn.cursor()
+    Connections are opened once in WAL mode with a busy timeout and kept open,
+    so sqlite3's per-connection statement cache lets repeated queries skip
+    re-preparing. A thread that already holds a connection gets the same one
+    back, which lets nested helpers share a single transaction.
+    """
     
+    def __init__(self, db_path=DB_PATH, max_connections=16, busy_timeout_ms=5000, cached_statements=256):
+        self.db_path = db_path
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cached_statements = cached_statements
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._local = threading.local()
+    
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+        # isolation_level=None leaves transaction control to transaction()
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout_ms / 1000,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=self.cached_statements
+        )
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        return conn
+    
+    @contextmanager
+    def connection(self):
+        """Check out a connection for the current thread and return it to the pool afterwards."""
+        held = getattr(self._local, 'conn', None)
+        if held is not None:
+            yield held
+            return
+        
+        self._slots.acquire()
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+            
+            self._local.conn = conn
+            try:
+                yield conn
+            finally:
+                self._local.conn = None
+                # Never hand a half-finished transaction to the next caller
+                if conn.in_transaction:
+                    conn.rollback()
+                self._idle.put(conn)
+        finally:
+            self._slots.release()
+    
+    @contextmanager
+    def transaction(self):
+        """
+        Run a block of statements as one write transaction.
+        
+        BEGIN IMMEDIATE takes the write lock up front, so concurrent writers
+        wait on busy_timeout instead of failing with "database is locked" when
+        a read lock cannot be upgraded. Nested calls join the outer transaction.
+        """
+        with self.connection() as conn:
+            if conn.in_transaction:
+                yield conn
+                return
+            
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            else:
+                conn.commit()
+    
+    def query(self, sql, params=()):
+        """Run a read query and return all rows."""
+        with self.connection() as conn:
+            return conn.execute(sql, params).fetchall()
+    
+    def query_one(self, sql, params=()):
+        """Run a read query and return the first row (or None)."""
+        with self.connection() as conn:
+            return conn.execute(sql, params).fetchone()
+    
+    def read_frame(self, sql, params=None):
+        """Run a read query and return the result as a DataFrame."""
+        with self.connection() as conn:
+            return pd.read_sql_query(sql, conn, params=params)
+    
+    def execute(self, sql, params=()):
+        """Run a single write statement in its own transaction and return the cursor."""
+        with self.transaction() as conn:
+            return conn.execute(sql, params)
+
+@st.cache_resource
+def get_db_pool():
+    """Return the connection pool shared by all sessions in this process."""
+    return ConnectionPool(DB_PATH)
+
+# Schema migrations
+def migrate_initial_schema(c):
+    """Create the original DentAI tables and seed demo data on an empty database."""
     # Create users table
     c.execute('''
     CREATE TABLE IF NOT EXISTS users (
@@ -224,20 +346,1003 @@ def init_db():
             INSERT INTO patients (first_name, last_name, date_of_birth, gender, phone, email, address)
             VALUES (?, ?, ?, ?, ?, ?, ?)
             ''', patient)
+
+# Secondary indexes for the per-patient lookups every page makes. The trailing
+# date columns let "ORDER BY ... date" queries and the patient progress status
+# queries be answered from the index alone.
+CLINICAL_INDEXES = [
+    ("idx_clinical_records_patient", "clinical_records", "patient_id, record_date"),
+    ("idx_clinical_records_date", "clinical_records", "record_date"),
+    ("idx_dental_examination_patient_type", "dental_examination", "patient_id, exam_type, exam_date DESC"),
+    ("idx_questionnaires_patient_type", "questionnaires", "patient_id, questionnaire_type, completion_date"),
+    ("idx_medical_questionnaires_patient", "medical_questionnaires", "patient_id, visit_date"),
+    ("idx_ai_reports_patient", "ai_reports", "patient_id, generated_at"),
+    ("idx_dental_history_patient", "dental_history", "patient_id"),
+    ("idx_allergies_patient", "allergies", "patient_id"),
+    ("idx_patients_created", "patients", "created_at"),
+]
+
+def create_indexes(c, indexes):
+    """Create each (name, table, columns) index that does not exist yet."""
+    for name, table, columns in indexes:
+        c.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+
+def migrate_clinical_indexes(c):
+    """Index the clinical tables by patient (and exam/questionnaire type)."""
+    create_indexes(c, CLINICAL_INDEXES)
+
+# Hot queries whose plans must stay on an index, as (description, sql, sample params)
+HOT_QUERIES = [
+    ("patient questionnaire status",
+     "SELECT questionnaire_type, completion_date FROM questionnaires WHERE patient_id = ?", (1,)),
+    ("questionnaire by type",
+     "SELECT responses FROM questionnaires WHERE patient_id = ? AND questionnaire_type = ?", (1, "medical")),
+    ("patient examination status",
+     "SELECT exam_type, exam_date FROM dental_examination WHERE patient_id = ?", (1,)),
+    ("examination by type",
+     "SELECT findings FROM dental_examination WHERE patient_id = ? AND exam_type = ?", (1, "extraoral")),
+    ("examination summary",
+     "SELECT exam_type, findings, exam_date FROM dental_examination WHERE patient_id = ? ORDER BY exam_type, exam_date DESC", (1,)),
+    ("patient clinical records",
+     "SELECT ai_analysis, record_date FROM clinical_records WHERE patient_id = ? AND ai_analysis IS NOT NULL", (1,)),
+    ("patient AI reports",
+     "SELECT report_text, generated_at FROM ai_reports WHERE patient_id = ? ORDER BY generated_at DESC", (1,)),
+    ("latest medical questionnaire",
+     "SELECT responses FROM medical_questionnaires WHERE patient_id = ? ORDER BY visit_date DESC LIMIT 1", (1,)),
+    ("patient dental history",
+     "SELECT * FROM dental_history WHERE patient_id = ?", (1,)),
+    ("patient allergies",
+     "SELECT * FROM allergies WHERE patient_id = ?", (1,)),
+    ("progress questionnaires",
+     "SELECT patient_id, questionnaire_type, responses, completion_date FROM questionnaires WHERE patient_id IN (?, ?)", (1, 2)),
+    ("progress examinations",
+     "SELECT patient_id, exam_type, findings, exam_date FROM dental_examination WHERE patient_id IN (?, ?)", (1, 2)),
+    ("progress clinical records",
+     "SELECT patient_id, record_date FROM clinical_records WHERE patient_id IN (?, ?)", (1, 2)),
+    ("progress AI reports",
+     "SELECT patient_id, report_text, generated_at FROM ai_reports WHERE patient_id IN (?, ?)", (1, 2)),
+    ("patient list page",
+     """SELECT id, first_name, last_name, date_of_birth, gender, phone, email FROM patients
+     WHERE (last_name, first_name, id) > (?, ?, ?) ORDER BY last_name, first_name, id LIMIT 51""", ("", "", 0)),
+    ("recent patients",
+     "SELECT id, first_name, last_name, date_of_birth FROM patients ORDER BY created_at DESC LIMIT 5", ()),
+    ("recent clinical records",
+     """SELECT cr.id, p.first_name || ' ' || p.last_name as patient_name, cr.record_date
+     FROM clinical_records cr JOIN patients p ON cr.patient_id = p.id
+     ORDER BY cr.record_date DESC LIMIT 5""", ()),
+    ("clinical records by diagnosis",
+     "SELECT patient_id, diagnosis FROM clinical_records WHERE diagnosis = ?", ("Dental caries",)),
+    ("clinical records by tooth",
+     "SELECT DISTINCT patient_id FROM clinical_record_teeth WHERE tooth = ?", (36,)),
+]
+
+def check_query_plans(pool, queries=HOT_QUERIES):
+    """
+    EXPLAIN every hot query and raise RuntimeError if any of them now falls
+    back to a full table scan or a temporary sort.
+    """
+    regressions = []
+    # Use a private connection: EXPLAIN statements kept in a pooled connection's
+    # statement cache are not re-planned after the schema changes
+    with closing(sqlite3.connect(pool.db_path)) as conn:
+        for description, sql, params in queries:
+            plan = [row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+            for step in plan:
+                full_scan = step.startswith("SCAN ") and " USING " not in step
+                if full_scan or "TEMP B-TREE" in step:
+                    regressions.append(f"{description}: {step}")
+    
+    if regressions:
+        raise RuntimeError("Query plan regression:\n" + "\n".join(regressions))
+
+def migrate_backfill_state(c):
+    """Track progress of batched data backfills so they can resume after a restart."""
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS data_backfills (
+        name TEXT PRIMARY KEY,
+        last_id INTEGER DEFAULT 0,
+        completed_at TIMESTAMP
+    )
+    ''')
+
+# Columns holding form data as JSON. Older rows were written as str(dict) and
+# are rewritten by backfill_json_columns(); once converted they can be queried
+# with SQLite's json1 functions, e.g. json_extract(responses, '$.general_health').
+JSON_COLUMNS = [
+    ("questionnaires", "responses"),
+    ("dental_examination", "findings"),
+    ("medical_questionnaires", "responses"),
+]
+
+def backfill_json_columns(pool, batch_size=500, pause=0.05):
+    """
+    Rewrite legacy str(dict) values in JSON_COLUMNS as canonical JSON.
+    
+    Rows are read in id order outside any transaction and written back one
+    small batch per transaction, pausing between batches, so page requests can
+    keep writing while a large database is converted. Progress is checkpointed
+    in data_backfills, and a finished column is never scanned again.
+    
+    Returns:
+        Number of rows converted
+    """
+    converted = 0
+    for table, column in JSON_COLUMNS:
+        name = f"json:{table}.{column}"
+        state = pool.query_one("SELECT last_id, completed_at FROM data_backfills WHERE name = ?", (name,))
+        if state and state[1]:
+            continue
+        last_id = state[0] if state else 0
+        
+        while True:
+            rows = pool.query(
+                f"SELECT id, {column} FROM {table} WHERE id > ? ORDER BY id LIMIT ?",
+                (last_id, batch_size)
+            )
+            if not rows:
+                break
+            
+            updates = []
+            for row_id, value in rows:
+                if not value:
+                    continue
+                try:
+                    json.loads(value)
+                    continue
+                except ValueError:
+                    pass
+                data = safe_eval(value)
+                if data:
+                    # Compare-and-set on the old value so a concurrent save wins
+                    updates.append((encode_json(data), row_id, value))
+            
+            last_id = rows[-1][0]
+            with pool.transaction() as conn:
+                conn.executemany(f"UPDATE {table} SET {column} = ? WHERE id = ? AND {column} = ?", updates)
+                conn.execute(
+                    "INSERT INTO data_backfills (name, last_id) VALUES (?, ?) "
+                    "ON CONFLICT(name) DO UPDATE SET last_id = excluded.last_id",
+                    (name, last_id)
+                )
+            converted += len(updates)
+            time.sleep(pause)
+        
+        pool.execute(
+            "INSERT INTO data_backfills (name, last_id, completed_at) VALUES (?, ?, CURRENT_TIMESTAMP) "
+            "ON CONFLICT(name) DO UPDATE SET completed_at = excluded.completed_at",
+            (name, last_id)
+        )
+    
+    return converted
+
+def run_json_backfill(pool, retry_delay=1, max_delay=60):
+    """
+    Run backfill_json_columns() until it finishes, for the background thread.
     
-    conn.commit()
-    conn.close()
+    A write lock held past busy_timeout surfaces as "database is locked";
+    the backfill then backs off exponentially and resumes from its checkpoint
+    instead of letting the thread die until the next restart.
+    """
+    delay = retry_delay
+    while True:
+        try:
+            return backfill_json_columns(pool)
+        except sqlite3.OperationalError as e:
+            print(f"JSON backfill paused ({e}); retrying in {delay}s")
+            time.sleep(delay)
+            delay = min(delay * 2, max_delay)
+
+def migrate_unique_form_keys(c):
+    """
+    Allow at most one questionnaire per type and one examination per type per patient.
+
+    Concurrent saves used to race between the existence check and the insert and
+    could leave duplicates behind; keep the newest row of each group before the
+    unique indexes go on.
+    """
+    c.execute('''
+    DELETE FROM questionnaires WHERE id NOT IN (
+        SELECT MAX(id) FROM questionnaires GROUP BY patient_id, questionnaire_type
+    )
+    ''')
+    c.execute('''
+    DELETE FROM dental_examination WHERE id NOT IN (
+        SELECT MAX(id) FROM dental_examination GROUP BY patient_id, exam_type
+    )
+    ''')
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS uq_questionnaires_patient_type ON questionnaires (patient_id, questionnaire_type)")
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS uq_dental_examination_patient_type ON dental_examination (patient_id, exam_type)")
+
+# Sources of the full-text search index, as (kind, table, name columns, body
+# columns). Each source row is stored under rowid = id * SEARCH_ROWID_STRIDE +
+# position in this list, so triggers can replace or delete it without a lookup.
+SEARCH_SOURCES = [
+    ("patient", "patients", ["first_name", "last_name"], ["phone", "email", "address"]),
+    ("clinical record", "clinical_records", [], ["chief_complaint", "transcription", "clinical_notes", "ai_analysis"]),
+    ("AI report", "ai_reports", [], ["report_text"]),
+]
+SEARCH_ROWID_STRIDE = 4
+
+def search_source_select(index, alias):
+    """SELECT producing the search index row for one SEARCH_SOURCES entry."""
+    kind, table, name_columns, body_columns = SEARCH_SOURCES[index]
+    patient_sql = f"{alias}.id" if table == "patients" else f"{alias}.patient_id"
+    name_sql, body_sql = (
+        " || ' ' || ".join(f"coalesce({alias}.{column}, '')" for column in columns) or "''"
+        for columns in (name_columns, body_columns)
+    )
+    return f"SELECT {alias}.id * {SEARCH_ROWID_STRIDE} + {index}, {patient_sql}, '{kind}', {name_sql}, {body_sql}"
+
+def rebuild_search_index(c):
+    """Repopulate search_index from its source tables."""
+    c.execute("DELETE FROM search_index")
+    for index, (kind, table, name_columns, body_columns) in enumerate(SEARCH_SOURCES):
+        c.execute(
+            f"INSERT INTO search_index (rowid, patient_id, kind, name, body) "
+            f"{search_source_select(index, 'src')} FROM {table} src"
+        )
+
+def migrate_search_index(c):
+    """
+    Full-text index over patient details, clinical records and AI reports.
+
+    The index is kept in sync by triggers on the source tables. SQLite builds
+    without FTS5 skip this migration and search_records() falls back to LIKE.
+    """
+    try:
+        c.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5 (
+            patient_id UNINDEXED,
+            kind UNINDEXED,
+            name,
+            body,
+            tokenize = 'unicode61 remove_diacritics 2'
+        )
+        ''')
+    except sqlite3.OperationalError as e:
+        print(f"Full-text search unavailable: {e}")
+        return
+
+    # Name matches outrank matches in free text
+    c.execute("INSERT INTO search_index (search_index, rank) VALUES ('rank', 'bm25(0.0, 0.0, 10.0, 1.0)')")
+
+    for index, (kind, table, name_columns, body_columns) in enumerate(SEARCH_SOURCES):
+        delete_sql = f"DELETE FROM search_index WHERE rowid = old.id * {SEARCH_ROWID_STRIDE} + {index};"
+        insert_sql = f"INSERT INTO search_index (rowid, patient_id, kind, name, body) {search_source_select(index, 'new')};"
+        c.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_search_insert AFTER INSERT ON {table} BEGIN {insert_sql} END")
+        c.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_search_update AFTER UPDATE ON {table} BEGIN {delete_sql} {insert_sql} END")
+        c.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_search_delete AFTER DELETE ON {table} BEGIN {delete_sql} END")
+
+    rebuild_search_index(c)
+
+def migrate_name_match_index(c):
+    """
+    Trigram and Soundex keys of patient names for typo-tolerant lookup.
+
+    Keys are written by index_patient_name() whenever a patient is saved; the
+    delete trigger only has to drop them.
+    """
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS patient_name_keys (
+        key TEXT NOT NULL,
+        patient_id INTEGER NOT NULL,
+        PRIMARY KEY (key, patient_id)
+    ) WITHOUT ROWID
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_patient_name_keys_patient ON patient_name_keys (patient_id)")
+    # How many patients share each key, so lookups can skip the unselective ones
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS patient_name_key_counts (
+        key TEXT PRIMARY KEY,
+        patients INTEGER NOT NULL
+    ) WITHOUT ROWID
+    ''')
+    c.execute('''
+    CREATE TRIGGER IF NOT EXISTS patient_name_keys_count_insert AFTER INSERT ON patient_name_keys
+    BEGIN
+        INSERT INTO patient_name_key_counts (key, patients) VALUES (new.key, 1)
+        ON CONFLICT (key) DO UPDATE SET patients = patients + 1;
+    END
+    ''')
+    c.execute('''
+    CREATE TRIGGER IF NOT EXISTS patient_name_keys_count_delete AFTER DELETE ON patient_name_keys
+    BEGIN
+        UPDATE patient_name_key_counts SET patients = patients - 1 WHERE key = old.key;
+    END
+    ''')
+    c.execute('''
+    CREATE TRIGGER IF NOT EXISTS patients_name_keys_delete AFTER DELETE ON patients
+    BEGIN
+        DELETE FROM patient_name_keys WHERE patient_id = old.id;
+    END
+    ''')
+
+    for patient_id, first_name, last_name in c.execute("SELECT id, first_name, last_name FROM patients").fetchall():
+        index_patient_name(c, patient_id, first_name, last_name)
+
+def migrate_patient_list_index(c):
+    """Index patients in patient list order (last name, first name, then rowid) for keyset paging."""
+    create_indexes(c, [("idx_patients_name", "patients", "last_name, first_name")])
+
+def migrate_response_caches(c):
+    """Persistent cache of LLM analyses, plus hit/miss counters shared by all caches."""
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS llm_cache (
+        cache_key TEXT PRIMARY KEY,
+        model TEXT NOT NULL,
+        response TEXT NOT NULL,
+        size_bytes INTEGER NOT NULL,
+        hits INTEGER DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        last_used_at TIMESTAMP DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now'))
+    )
+    ''')
+    create_indexes(c, [("idx_llm_cache_last_used", "llm_cache", "last_used_at")])
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS cache_stats (
+        name TEXT PRIMARY KEY,
+        hits INTEGER DEFAULT 0,
+        misses INTEGER DEFAULT 0
+    )
+    ''')
+
+def migrate_transcription_cache(c):
+    """Transcripts keyed by the SHA-256 of the audio bytes and the model/language used."""
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS transcription_cache (
+        audio_sha256 TEXT NOT NULL,
+        model TEXT NOT NULL,
+        language TEXT NOT NULL DEFAULT '',
+        transcript TEXT NOT NULL,
+        hits INTEGER DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (audio_sha256, model, language)
+    )
+    ''')
+
+def migrate_job_queue(c):
+    """Background transcription and analysis jobs, polled by the UI and resumed after a restart."""
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        patient_id INTEGER,
+        status TEXT NOT NULL DEFAULT 'queued',
+        progress REAL DEFAULT 0,
+        message TEXT,
+        payload TEXT NOT NULL,
+        result TEXT,
+        error TEXT,
+        attempts INTEGER DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        started_at TIMESTAMP,
+        finished_at TIMESTAMP,
+        FOREIGN KEY (patient_id) REFERENCES patients (id)
+    )
+    ''')
+    create_indexes(c, [
+        ("idx_jobs_status", "jobs", "status, id"),
+        ("idx_jobs_patient_kind", "jobs", "patient_id, kind, id"),
+    ])
+
+def add_columns(c, table, columns):
+    """Add each (name, type) column that the table does not have yet."""
+    existing = {row[1] for row in c.execute(f"PRAGMA table_info({table})")}
+    for name, column_type in columns:
+        if name not in existing:
+            c.execute(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
+
+def migrate_clinical_fields(c):
+    """
+    Structured clinical fields extracted from conversations, next to the
+    existing chief_complaint and treatment_plan columns. Symptoms are a JSON
+    list; involved teeth also get a row each in clinical_record_teeth so
+    records can be looked up by tooth.
+    """
+    add_columns(c, "clinical_records", [
+        ("symptoms", "TEXT"),
+        ("teeth_involved", "TEXT"),
+        ("diagnosis", "TEXT"),
+        ("follow_up", "TEXT"),
+        ("extraction_model", "TEXT"),
+        ("extracted_at", "TIMESTAMP"),
+    ])
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS clinical_record_teeth (
+        record_id INTEGER NOT NULL,
+        patient_id INTEGER NOT NULL,
+        tooth INTEGER NOT NULL,
+        PRIMARY KEY (record_id, tooth),
+        FOREIGN KEY (record_id) REFERENCES clinical_records (id),
+        FOREIGN KEY (patient_id) REFERENCES patients (id)
+    )
+    ''')
+    create_indexes(c, [
+        ("idx_clinical_records_diagnosis", "clinical_records", "diagnosis"),
+        ("idx_clinical_records_chief_complaint", "clinical_records", "chief_complaint"),
+        ("idx_clinical_record_teeth_tooth", "clinical_record_teeth", "tooth, patient_id"),
+    ])
+
+def migrate_llm_cache_size(c):
+    """
+    Keep the LLM cache's total size in cache_stats, maintained by triggers,
+    so a put can tell whether to evict without summing the whole table.
+    """
+    add_columns(c, "cache_stats", [("bytes", "INTEGER DEFAULT 0")])
+    c.execute(
+        "INSERT INTO cache_stats (name, bytes) SELECT 'llm', COALESCE(SUM(size_bytes), 0) FROM llm_cache WHERE true "
+        "ON CONFLICT(name) DO UPDATE SET bytes = excluded.bytes"
+    )
+    c.execute('''
+    CREATE TRIGGER IF NOT EXISTS llm_cache_size_insert AFTER INSERT ON llm_cache BEGIN
+        UPDATE cache_stats SET bytes = bytes + NEW.size_bytes WHERE name = 'llm';
+    END
+    ''')
+    c.execute('''
+    CREATE TRIGGER IF NOT EXISTS llm_cache_size_update AFTER UPDATE OF size_bytes ON llm_cache BEGIN
+        UPDATE cache_stats SET bytes = bytes + NEW.size_bytes - OLD.size_bytes WHERE name = 'llm';
+    END
+    ''')
+    c.execute('''
+    CREATE TRIGGER IF NOT EXISTS llm_cache_size_delete AFTER DELETE ON llm_cache BEGIN
+        UPDATE cache_stats SET bytes = bytes - OLD.size_bytes WHERE name = 'llm';
+    END
+    ''')
+
+# Ordered list of (version, description, migration). Append new migrations at the
+# end and never edit one that has shipped: databases record the versions they
+# have already applied in schema_version and only run the ones after it.
+MIGRATIONS = [
+    (1, "initial schema", migrate_initial_schema),
+    (2, "clinical table indexes", migrate_clinical_indexes),
+    (3, "data backfill state", migrate_backfill_state),
+    (4, "unique questionnaire and examination keys", migrate_unique_form_keys),
+    (5, "full-text search index", migrate_search_index),
+    (6, "patient name match index", migrate_name_match_index),
+    (7, "patient list order index", migrate_patient_list_index),
+    (8, "LLM response cache", migrate_response_caches),
+    (9, "transcription cache", migrate_transcription_cache),
+    (10, "background job queue", migrate_job_queue),
+    (11, "structured clinical fields", migrate_clinical_fields),
+    (12, "LLM cache size total", migrate_llm_cache_size),
+]
+
+def run_migrations(pool):
+    """
+    Apply any pending migrations and return the resulting schema version.
+    
+    Each migration runs in its own write transaction together with its
+    schema_version row, so a large database is upgraded one step at a time and
+    an interrupted upgrade resumes from the last completed version.
+    """
+    with pool.transaction() as conn:
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+    
+    current_version = pool.query_one("SELECT COALESCE(MAX(version), 0) FROM schema_version")[0]
+    for version, description, migration in MIGRATIONS:
+        if version <= current_version:
+            continue
+        
+        with pool.transaction() as conn:
+            # Re-read inside the write lock in case another process migrated first
+            current_version = conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+            if version <= current_version:
+                continue
+            
+            migration(conn.cursor())
+            conn.execute("INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                         (version, description))
+            current_version = version
+    
+    return current_version
+
+@st.cache_resource(show_spinner=False)
+def init_db():
+    """
+    Bring the database schema up to date once per process.
+    
+    main() calls this on every rerun; st.cache_resource latches the first
+    successful run so later reruns do no DDL work at all.
+    """
+    pool = get_db_pool()
+    version = run_migrations(pool)
+    
+    # A missing or unusable index is a performance bug, not an outage
+    try:
+        check_query_plans(pool)
+    except RuntimeError as e:
+        print(str(e))
+    
+    # Convert legacy str(dict) rows in the background; decode_json reads both formats meanwhile
+    threading.Thread(target=run_json_backfill, args=(pool,), name="dentai-json-backfill", daemon=True).start()
+    
+    return version
+
+# Data access helpers
+def upsert_row(table, key, values, timestamp_column=None):
+    """
+    Insert a row or update the existing one with the same unique key, atomically.
+
+    Args:
+        table: Table with a unique index over the columns in key
+        key: Dict of key column -> value identifying the row
+        values: Dict of column -> value to write
+        timestamp_column: Optional column set to CURRENT_TIMESTAMP on every write
+    """
+    columns = list(key) + list(values)
+    assignments = [f"{column} = excluded.{column}" for column in values]
+    placeholders = ["?"] * len(columns)
+    if timestamp_column:
+        columns.append(timestamp_column)
+        placeholders.append("CURRENT_TIMESTAMP")
+        assignments.append(f"{timestamp_column} = CURRENT_TIMESTAMP")
+
+    get_db_pool().execute(
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(placeholders)}) "
+        f"ON CONFLICT ({', '.join(key)}) DO UPDATE SET {', '.join(assignments)}",
+        tuple(key.values()) + tuple(values.values())
+    )
+
+def save_questionnaire(patient_id, questionnaire_type, responses):
+    """Create or replace a patient's questionnaire of the given type."""
+    upsert_row(
+        "questionnaires",
+        {"patient_id": patient_id, "questionnaire_type": questionnaire_type},
+        {"responses": encode_json(responses)},
+        timestamp_column="completion_date"
+    )
+
+def save_examination(patient_id, exam_type, findings):
+    """Create or replace a patient's examination findings of the given type."""
+    upsert_row(
+        "dental_examination",
+        {"patient_id": patient_id, "exam_type": exam_type},
+        {"findings": encode_json(findings)},
+        timestamp_column="exam_date"
+    )
+
+def save_clinical_record(patient_id, touch_date=False, **fields):
+    """
+    Write fields to the patient's clinical record, creating it if needed.
+
+    clinical_records keeps one row per patient by convention only (older
+    databases may hold several), so the update targets the oldest row and the
+    update-or-insert runs under a single write lock instead of relying on a
+    unique key.
+
+    Args:
+        patient_id: Patient the record belongs to
+        touch_date: Also set record_date to the current time
+        **fields: Column -> value pairs, e.g. transcription="..."
+
+    Returns:
+        The id of the record written
+    """
+    assignments = [f"{column} = ?" for column in fields]
+    columns = ["patient_id"] + list(fields)
+    placeholders = ["?"] * len(columns)
+    if touch_date:
+        assignments.append("record_date = CURRENT_TIMESTAMP")
+        columns.append("record_date")
+        placeholders.append("CURRENT_TIMESTAMP")
+
+    with get_db_pool().transaction() as conn:
+        row = conn.execute(
+            "SELECT id FROM clinical_records WHERE patient_id = ? ORDER BY id LIMIT 1", (patient_id,)
+        ).fetchone()
+        if row is None:
+            record_id = conn.execute(
+                f"INSERT INTO clinical_records ({', '.join(columns)}) VALUES ({', '.join(placeholders)})",
+                (patient_id,) + tuple(fields.values())
+            ).lastrowid
+        else:
+            record_id = row[0]
+            if assignments:
+                conn.execute(
+                    f"UPDATE clinical_records SET {', '.join(assignments)} WHERE id = ?",
+                    tuple(fields.values()) + (record_id,)
+                )
+    invalidate_dashboard_cache()
+    return record_id
+
+def save_clinical_fields(record_id, fields, model):
+    """
+    Write extracted ClinicalFields to a clinical record.
+    
+    Chief complaint and treatment plan are only filled in when empty, so
+    anything the clinician entered by hand is kept. The other fields and the
+    per-tooth rows are replaced by the latest extraction.
+    """
+    with get_db_pool().transaction() as conn:
+        patient_id = conn.execute("SELECT patient_id FROM clinical_records WHERE id = ?", (record_id,)).fetchone()[0]
+        conn.execute(
+            "UPDATE clinical_records SET symptoms = ?, teeth_involved = ?, diagnosis = ?, follow_up = ?, "
+            "extraction_model = ?, chief_complaint = COALESCE(NULLIF(chief_complaint, ''), ?), "
+            "treatment_plan = COALESCE(NULLIF(treatment_plan, ''), ?), extracted_at = CURRENT_TIMESTAMP WHERE id = ?",
+            (encode_json(fields.symptoms), encode_json(fields.teeth_involved), fields.diagnosis or None,
+             fields.follow_up or None, model, fields.chief_complaint or None, fields.treatment_plan or None, record_id)
+        )
+        conn.execute("DELETE FROM clinical_record_teeth WHERE record_id = ?", (record_id,))
+        conn.executemany(
+            "INSERT INTO clinical_record_teeth (record_id, patient_id, tooth) VALUES (?, ?, ?)",
+            [(record_id, patient_id, tooth) for tooth in fields.teeth_involved]
+        )
+    # Only once committed, so a concurrent render cannot cache the old rows again
+    invalidate_dashboard_cache()
+
+# Dashboard aggregates are shared by every session and recomputed when
+# save_patient() or save_clinical_record() change the underlying tables; the
+# TTL bounds staleness from writes made by other processes.
+DASHBOARD_CACHE_TTL = 300
+
+@st.cache_data(ttl=DASHBOARD_CACHE_TTL, show_spinner=False)
+def recent_patients(limit=5):
+    """The most recently added patients."""
+    return get_db_pool().read_frame(
+        "SELECT id, first_name, last_name, date_of_birth FROM patients ORDER BY created_at DESC LIMIT ?",
+        params=(limit,)
+    )
+
+@st.cache_data(ttl=DASHBOARD_CACHE_TTL, show_spinner=False)
+def recent_clinical_records(limit=5):
+    """The most recent clinical records with the patient's name."""
+    return get_db_pool().read_frame(
+        """
+        SELECT cr.id, p.first_name || ' ' || p.last_name as patient_name, cr.record_date
+        FROM clinical_records cr
+        JOIN patients p ON cr.patient_id = p.id
+        ORDER BY cr.record_date DESC LIMIT ?
+        """,
+        params=(limit,)
+    )
+
+def invalidate_dashboard_cache():
+    """Drop cached dashboard aggregates after patients or clinical records change."""
+    recent_patients.clear()
+    recent_clinical_records.clear()
+
+# Questionnaires and examinations counted towards a patient's progress
+PROGRESS_QUESTIONNAIRES = ["medical", "dental", "allergies", "medications"]
+
+@dataclass
+class PatientProgress:
+    """Everything the patient progress view shows for one patient, with form data already decoded."""
+    patient: tuple
+    questionnaires: dict = field(default_factory=dict)   # type -> (responses dict, completion_date)
+    examinations: dict = field(default_factory=dict)     # exam_type -> (findings dict, exam_date)
+    clinical_record_dates: list = field(default_factory=list)
+    ai_reports: list = field(default_factory=list)       # (report_text, generated_at), newest first
+
+    @property
+    def questionnaire_count(self):
+        return sum(1 for q in PROGRESS_QUESTIONNAIRES if q in self.questionnaires)
+
+    @property
+    def exam_count(self):
+        return len(self.examinations)
+
+def load_patient_progress(patient_ids):
+    """
+    Load progress for a page of patients in a fixed number of queries.
+
+    One query per table, whatever the number of patients, questionnaires,
+    examinations or reports, and each JSON column is decoded exactly once.
+
+    Args:
+        patient_ids: Iterable of patient ids
+
+    Returns:
+        Dict of patient id -> PatientProgress; unknown ids are left out
+    """
+    patient_ids = list(dict.fromkeys(patient_ids))
+    if not patient_ids:
+        return {}
+
+    placeholders = ", ".join("?" * len(patient_ids))
+    params = tuple(patient_ids)
+    progress = {}
+    with get_db_pool().connection() as conn:
+        for row in conn.execute(f"SELECT * FROM patients WHERE id IN ({placeholders})", params):
+            progress[row[0]] = PatientProgress(patient=row)
+
+        for patient_id, questionnaire_type, responses, completion_date in conn.execute(
+            f"SELECT patient_id, questionnaire_type, responses, completion_date FROM questionnaires WHERE patient_id IN ({placeholders})",
+            params
+        ):
+            if patient_id in progress:
+                progress[patient_id].questionnaires[questionnaire_type] = (decode_json(responses), completion_date)
+
+        for patient_id, exam_type, findings, exam_date in conn.execute(
+            f"SELECT patient_id, exam_type, findings, exam_date FROM dental_examination WHERE patient_id IN ({placeholders})",
+            params
+        ):
+            if patient_id in progress:
+                progress[patient_id].examinations[exam_type] = (decode_json(findings), exam_date)
+
+        for patient_id, record_date in conn.execute(
+            f"SELECT patient_id, record_date FROM clinical_records WHERE patient_id IN ({placeholders})",
+            params
+        ):
+            if patient_id in progress:
+                progress[patient_id].clinical_record_dates.append(record_date)
+
+        for patient_id, report_text, generated_at in conn.execute(
+            f"SELECT patient_id, report_text, generated_at FROM ai_reports WHERE patient_id IN ({placeholders})",
+            params
+        ):
+            if patient_id in progress:
+                progress[patient_id].ai_reports.append((report_text, generated_at))
+
+    for entry in progress.values():
+        entry.ai_reports.sort(key=lambda report: report[1] or "", reverse=True)
+    return progress
+
+def has_search_index():
+    """True when the full-text search_index exists (SQLite was built with FTS5)."""
+    return get_db_pool().query_one("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'search_index'") is not None
+
+def build_fts_query(search_term):
+    """
+    Turn free text into an FTS5 query: "quoted text" is matched as a phrase,
+    other words as prefixes, and all parts must match.
+    """
+    parts = []
+    for phrase, word in re.findall(r'"([^"]*)"|(\S+)', search_term):
+        text = (phrase or word).replace('"', '').strip()
+        if text:
+            parts.append(f'"{text}"' if phrase else f'"{text}"*')
+    return " ".join(parts)
+
+def search_records(search_term, limit=50):
+    """
+    Ranked full-text search over patients, clinical records and AI reports.
+
+    A term of digits also looks the patient up by id, and that patient is
+    listed first whether or not the number appears in any indexed text.
+
+    Returns:
+        DataFrame of matches, best first, with the patient, where the match
+        was found and a highlighted snippet
+    """
+    db = get_db_pool()
+    search_term = search_term.strip()
+    fts_query = build_fts_query(search_term)
+    id_match = int(search_term) if search_term.isdigit() else -1
+
+    if fts_query and has_search_index():
+        return db.read_frame(
+            """
+            SELECT id, first_name, last_name, date_of_birth, phone, match_in, snippet
+            FROM (
+                SELECT id, first_name, last_name, date_of_birth, phone,
+                       'patient id' AS match_in, '' AS snippet, 0 AS by_text, 0 AS score
+                FROM patients
+                WHERE id = ?
+                UNION ALL
+                SELECT p.id, p.first_name, p.last_name, p.date_of_birth, p.phone,
+                       s.kind, snippet(search_index, -1, '**', '**', '...', 16), 1, s.rank
+                FROM search_index s
+                JOIN patients p ON p.id = s.patient_id
+                WHERE search_index MATCH ?
+            )
+            ORDER BY by_text, score
+            LIMIT ?
+            """,
+            params=(id_match, fts_query, limit)
+        )
+
+    # No FTS5 in this SQLite build; use the unindexed name/phone search
+    pattern = f"%{search_term}%"
+    return db.read_frame(
+        """
+        SELECT id, first_name, last_name, date_of_birth, phone,
+               'patient' AS match_in, '' AS snippet
+        FROM patients
+        WHERE first_name LIKE ? OR last_name LIKE ? OR phone LIKE ? OR id = ?
+        ORDER BY id <> ?, last_name, first_name
+        LIMIT ?
+        """,
+        params=(pattern, pattern, pattern, id_match, id_match, limit)
+    )
+
+def add_ages(df, column="date_of_birth"):
+    """Add an Age column computed from an ISO date column in one vectorized pass."""
+    today = date.today()
+    dob = pd.to_datetime(df[column], format="%Y-%m-%d", errors="coerce")
+    before_birthday = (dob.dt.month > today.month) | ((dob.dt.month == today.month) & (dob.dt.day > today.day))
+    df["Age"] = (today.year - dob.dt.year - before_birthday).astype("Int64")
+    return df
+
+def list_patients(name_filter="", after=None, page_size=50):
+    """
+    One page of the patient list, ordered by last name, first name and id.
+
+    Pages are addressed by keyset rather than offset: pass the cursor returned
+    for the previous page as after. Each page is a bounded walk of
+    idx_patients_name however many patients there are, and the name filter
+    (word prefixes, via the full-text index when available) runs in SQLite.
+
+    Returns:
+        (DataFrame of patients with an Age column, cursor of the next page or
+        None on the last page)
+    """
+    conditions = []
+    params = []
+    if after:
+        conditions.append("(last_name, first_name, id) > (?, ?, ?)")
+        params.extend(after)
+
+    fts_query = build_fts_query(name_filter)
+    if fts_query and has_search_index():
+        conditions.append("id IN (SELECT patient_id FROM search_index WHERE search_index MATCH ?)")
+        params.append(f"name : ({fts_query})")
+    elif name_filter.strip():
+        conditions.append("(first_name LIKE ? OR last_name LIKE ?)")
+        params.extend([f"%{name_filter.strip()}%"] * 2)
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    df = get_db_pool().read_frame(
+        f"""
+        SELECT id, first_name, last_name, date_of_birth, gender, phone, email
+        FROM patients {where}
+        ORDER BY last_name, first_name, id
+        LIMIT ?
+        """,
+        params=tuple(params) + (page_size + 1,)
+    )
+
+    next_cursor = None
+    if len(df) > page_size:
+        df = df.iloc[:page_size]
+        last = df.iloc[-1]
+        next_cursor = (last["last_name"], last["first_name"], int(last["id"]))
+    return add_ages(df), next_cursor
+
+# Name matching
+SOUNDEX_CODES = {
+    **dict.fromkeys("bfpv", "1"), **dict.fromkeys("cgjkqsxz", "2"),
+    **dict.fromkeys("dt", "3"), "l": "4", **dict.fromkeys("mn", "5"), "r": "6",
+}
+
+def name_tokens(name):
+    """Lowercase ASCII words of a name, e.g. "O'Brien-Núñez" -> ["obrien", "nunez"]."""
+    ascii_name = unicodedata.normalize("NFKD", name or "").encode("ascii", "ignore").decode()
+    return re.findall(r"[a-z]+", ascii_name.lower().replace("'", ""))
+
+def soundex(token):
+    """American Soundex code of a lowercase word, e.g. "johnson" -> "J525"."""
+    code = token[0].upper()
+    previous = SOUNDEX_CODES.get(token[0], "")
+    for char in token[1:]:
+        digit = SOUNDEX_CODES.get(char, "")
+        if digit and digit != previous:
+            code += digit
+        # h and w do not separate letters with the same code; vowels do
+        if char not in "hw":
+            previous = digit
+    return (code + "000")[:4]
+
+def name_match_keys(*names):
+    """Index keys for a name: padded trigrams ("t:") and Soundex codes ("s:") of each word."""
+    keys = set()
+    for token in name_tokens(" ".join(name for name in names if name)):
+        padded = f"  {token} "
+        keys.update(f"t:{padded[i:i + 3]}" for i in range(len(padded) - 2))
+        keys.add(f"s:{soundex(token)}")
+    return keys
+
+def index_patient_name(c, patient_id, first_name, last_name):
+    """Replace the name match keys of one patient; call inside the transaction that saves the patient."""
+    c.execute("DELETE FROM patient_name_keys WHERE patient_id = ?", (patient_id,))
+    c.executemany(
+        "INSERT INTO patient_name_keys (key, patient_id) VALUES (?, ?)",
+        [(key, patient_id) for key in name_match_keys(first_name, last_name)]
+    )
+
+def save_patient(first_name, last_name, date_of_birth=None, gender=None, phone=None,
+                 email=None, address=None, patient_id=None):
+    """
+    Insert a patient, or update it when patient_id is given, keeping the name
+    match index in step.
+
+    Returns:
+        The patient's id
+    """
+    values = (first_name, last_name, date_of_birth, gender, phone, email, address)
+    with get_db_pool().transaction() as conn:
+        if patient_id is None:
+            patient_id = conn.execute('''
+            INSERT INTO patients (first_name, last_name, date_of_birth, gender, phone, email, address)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', values).lastrowid
+        else:
+            conn.execute('''
+            UPDATE patients SET first_name = ?, last_name = ?, date_of_birth = ?, gender = ?,
+                phone = ?, email = ?, address = ?
+            WHERE id = ?
+            ''', values + (patient_id,))
+        index_patient_name(conn, patient_id, first_name, last_name)
+    invalidate_dashboard_cache()
+    return patient_id
+
+def find_similar_patients(name, limit=10, candidates=100, max_postings=10000, min_score=0.3):
+    """
+    Typo-tolerant patient lookup by name, e.g. "Jonson" finds "Johnson".
+
+    Candidates are the patients sharing the most trigram and Soundex keys with
+    the query. Only the rarest keys are looked up, up to max_postings index
+    entries in total, so the cost stays flat as the patient table grows.
+    Candidates are then re-scored on trigram overlap (Jaccard) plus the share
+    of query words whose Soundex code they match, and those scoring below
+    min_score are dropped as not similar at all.
+
+    Returns:
+        DataFrame with id, first_name, last_name, date_of_birth, phone and a
+        0-1 score, best match first
+    """
+    columns = ["id", "first_name", "last_name", "date_of_birth", "phone", "score"]
+    query_keys = name_match_keys(name)
+    if not query_keys:
+        return pd.DataFrame(columns=columns)
+
+    db = get_db_pool()
+    key_list = sorted(query_keys)
+    counts = db.query(
+        f"SELECT key, patients FROM patient_name_key_counts WHERE key IN ({', '.join('?' * len(key_list))}) AND patients > 0 ORDER BY patients",
+        tuple(key_list)
+    )
+    lookup_keys = []
+    postings = 0
+    for key, patients in counts:
+        if lookup_keys and postings + patients > max_postings:
+            break
+        lookup_keys.append(key)
+        postings += patients
+    if not lookup_keys:
+        return pd.DataFrame(columns=columns)
+
+    rows = db.query(
+        f"""
+        SELECT p.id, p.first_name, p.last_name, p.date_of_birth, p.phone
+        FROM (
+            SELECT patient_id, SUM(CASE WHEN key LIKE 's:%' THEN 3 ELSE 1 END) AS shared
+            FROM patient_name_keys
+            WHERE key IN ({', '.join('?' * len(lookup_keys))})
+            GROUP BY patient_id
+            ORDER BY shared DESC
+            LIMIT ?
+        ) k
+        JOIN patients p ON p.id = k.patient_id
+        """,
+        tuple(lookup_keys) + (candidates,)
+    )
+
+    query_trigrams = {key for key in query_keys if key.startswith("t:")}
+    query_codes = {key for key in query_keys if key.startswith("s:")}
+    scored = []
+    for row in rows:
+        keys = name_match_keys(row[1], row[2])
+        trigrams = {key for key in keys if key.startswith("t:")}
+        jaccard = len(query_trigrams & trigrams) / len(query_trigrams | trigrams)
+        phonetic = len(query_codes & keys) / len(query_codes)
+        score = round(0.7 * jaccard + 0.3 * phonetic, 3)
+        if score >= min_score:
+            scored.append(row + (score,))
+
+    scored.sort(key=lambda row: row[-1], reverse=True)
+    return pd.DataFrame(scored[:limit], columns=columns)
 
 # Authentication functions
 def login(username, password):
-    conn = sqlite3.connect('data/dentai.db')
-    c = conn.cursor()
-    
     hashed_password = hashlib.sha256(password.encode()).hexdigest()
-    c.execute("SELECT * FROM users WHERE username = ? AND password = ?", (username, hashed_password))
-    user = c.fetchone()
-    
-    conn.close()
+    user = get_db_pool().query_one("SELECT * FROM users WHERE username = ? AND password = ?", (username, hashed_password))
     
     if user:
         st.session_state.logged_in = True
@@ -246,6 +1351,72 @@ def login(username, password):
         return True
     return False
 
+# Shared widgets
+def patient_picker(label, patients_df, key, search=False, limit=50):
+    """
+    Selectbox of patients labelled by name.
+
+    Labels come from an id -> name dict built once per render, so formatting
+    each option is a dict lookup. With search=True a text box above it looks
+    patients up by name in SQLite, and the typed results replace patients_df.
+
+    Args:
+        label: Selectbox label
+        patients_df: DataFrame with id, first_name and last_name columns
+        key: Widget key prefix, unique per page
+        search: Offer a typeahead box for patients not in patients_df
+        limit: Maximum number of typeahead results
+
+    Returns:
+        The selected patient id
+    """
+    if search:
+        typed = st.text_input("Find a patient by name", key=f"{key}_search")
+        if typed.strip():
+            matches = list_patients(typed, page_size=limit)[0]
+            if matches.empty:
+                st.info("No patients match that name.")
+            else:
+                patients_df = matches
+
+    names = dict(zip(patients_df['id'].tolist(), (patients_df['first_name'] + " " + patients_df['last_name']).tolist()))
+    return st.selectbox(label, list(names), format_func=names.get, key=key)
+
+def job_progress(job, label):
+    """
+    Progress bar and status line for an unfinished background job.
+
+    A queued job that lost its API key in a restart is resumed with this
+    session's key. Returns True while the job is still unfinished.
+    """
+    if not job.active:
+        return False
+    
+    jobs = get_job_queue()
+    if job.status == "queued" and jobs.waiting_for_key(job.id):
+        if not st.session_state.get('openai_api_key'):
+            st.warning(f"{label} was interrupted by a restart. Enter your OpenAI API key in Settings to resume it.")
+            return False
+        jobs.resume(job.id, st.session_state.openai_api_key)
+    
+    st.progress(min(max(job.progress or 0.0, 0.0), 1.0), text=f"{label}: {job.message or job.status}")
+    return True
+
+def poll_jobs(*jobs):
+    """
+    Rerun the page after a short pause while any of the given jobs is
+    unfinished, more often while an analysis is streaming its reports. A
+    queued job still waiting for an API key cannot make progress, so it is
+    not polled.
+    """
+    job_queue = get_job_queue()
+    active = [job for job in jobs
+              if job is not None and job.active and not (job.status == "queued" and job_queue.waiting_for_key(job.id))]
+    if active:
+        streaming = any(job.kind == "analysis" and job.status == "running" for job in active)
+        time.sleep(JOB_STREAM_POLL_SECONDS if streaming else JOB_POLL_SECONDS)
+        st.rerun()
+
 # Page functions
 def login_page():
     st.title("DentAI - Login")
@@ -368,21 +1539,14 @@ def dashboard_page():
     with col1:
         st.subheader("Recent Patients")
         try:
-            conn = sqlite3.connect('data/dentai.db')
-            patients_df = pd.read_sql_query(
-                "SELECT id, first_name, last_name, date_of_birth FROM patients ORDER BY created_at DESC LIMIT 5",
-                conn
-            )
-            conn.close()
+            patients_df = recent_patients()
             
             if not patients_df.empty:
                 st.dataframe(patients_df)
                 
                 # Quick action buttons
-                selected_patient_id = st.selectbox(
-                    "Select a patient for quick actions:",
-                    patients_df['id'].tolist(),
-                    format_func=lambda x: f"{patients_df[patients_df['id'] == x]['first_name'].iloc[0]} {patients_df[patients_df['id'] == x]['last_name'].iloc[0]}"
+                selected_patient_id = patient_picker(
+                    "Select a patient for quick actions:", patients_df, key="dashboard_patient", search=True
                 )
                 
                 col1, col2, col3 = st.columns(3)
@@ -409,17 +1573,7 @@ def dashboard_page():
     with col2:
         st.subheader("Recent Clinical Records")
         try:
-            conn = sqlite3.connect('data/dentai.db')
-            records_df = pd.read_sql_query(
-                """
-                SELECT cr.id, p.first_name || ' ' || p.last_name as patient_name, cr.record_date
-                FROM clinical_records cr
-                JOIN patients p ON cr.patient_id = p.id
-                ORDER BY cr.record_date DESC LIMIT 5
-                """,
-                conn
-            )
-            conn.close()
+            records_df = recent_clinical_records()
             
             if not records_df.empty:
                 st.dataframe(records_df)
@@ -476,44 +1630,37 @@ def patients_page():
     with tab1:
         st.subheader("Patient List")
         try:
-            conn = sqlite3.connect('data/dentai.db')
-            patients_df = pd.read_sql_query(
-                "SELECT id, first_name, last_name, date_of_birth, gender, phone, email FROM patients ORDER BY last_name, first_name",
-                conn
-            )
-            conn.close()
-            
+            # Display the patient list with a filter
+            st.write("Filter patients by name:")
+            filter_name = st.text_input("", key="patient_filter")
+
+            # Start again from the first page whenever the filter changes
+            if st.session_state.get('patient_list_filter') != filter_name:
+                st.session_state.patient_list_filter = filter_name
+                st.session_state.patient_list_pages = [None]
+            page_cursors = st.session_state.patient_list_pages
+
+            patients_df, next_cursor = list_patients(filter_name, after=page_cursors[-1])
+
             if not patients_df.empty:
-                # Add age calculation
-                try:
-                    patients_df['Age'] = patients_df['date_of_birth'].apply(
-                        lambda x: date.today().year - datetime.strptime(x, "%Y-%m-%d").date().year 
-                        if x else "Unknown"
-                    )
-                except Exception as e:
-                    st.warning(f"Error calculating ages: {str(e)}")
-                    patients_df['Age'] = "Unknown"
-                
-                # Display the dataframe with a filter
-                st.write("Filter patients by name:")
-                filter_name = st.text_input("", key="patient_filter")
-                
-                if filter_name:
-                    filtered_df = patients_df[
-                        patients_df['first_name'].str.contains(filter_name, case=False) | 
-                        patients_df['last_name'].str.contains(filter_name, case=False)
-                    ]
-                    st.dataframe(filtered_df)
-                else:
-                    st.dataframe(patients_df)
-                
+                st.dataframe(patients_df)
+
+                # Page navigation
+                col1, col2, col3 = st.columns([1, 1, 4])
+                with col1:
+                    if st.button("← Previous", key="patient_list_prev", disabled=len(page_cursors) == 1):
+                        page_cursors.pop()
+                        st.rerun()
+                with col2:
+                    if st.button("Next →", key="patient_list_next", disabled=next_cursor is None):
+                        page_cursors.append(next_cursor)
+                        st.rerun()
+                with col3:
+                    st.write(f"Page {len(page_cursors)}")
+
                 # Patient selection and actions
                 st.write("### Patient Actions")
-                selected_patient_id = st.selectbox(
-                    "Select a patient:",
-                    patients_df['id'].tolist(),
-                    format_func=lambda x: f"{patients_df[patients_df['id'] == x]['first_name'].iloc[0]} {patients_df[patients_df['id'] == x]['last_name'].iloc[0]}"
-                )
+                selected_patient_id = patient_picker("Select a patient:", patients_df, key="patient_list_patient")
                 
                 # Action buttons in columns
                 col1, col2, col3, col4, col5 = st.columns(5)
@@ -546,6 +1693,8 @@ def patients_page():
                     if st.button("Delete Patient", key="delete_patient_btn"):
                         st.session_state.confirm_delete = selected_patient_id
                         st.rerun()
+            elif filter_name:
+                st.info("No patients match this filter.")
             else:
                 st.info("No patients found. Add patients to get started.")
         except Exception as e:
@@ -556,13 +1705,11 @@ def patients_page():
             patient_id = st.session_state.selected_patient
             
             try:
-                # Get patient basic info
-                conn = sqlite3.connect('data/dentai.db')
-                c = conn.cursor()
-                c.execute("SELECT * FROM patients WHERE id = ?", (patient_id,))
-                patient_data = c.fetchone()
+                # Load everything the progress view needs in one batch
+                progress = load_patient_progress([patient_id]).get(patient_id)
                 
-                if patient_data:
+                if progress:
+                    patient_data = progress.patient
                     st.write("---")
                     st.subheader(f"Patient Details: {patient_data[1]} {patient_data[2]}")
                     
@@ -581,24 +1728,6 @@ def patients_page():
                         st.write(f"**Email:** {patient_data[6]}")
                         st.write(f"**Address:** {patient_data[7]}")
                     
-                    # Get questionnaire completion status
-                    c.execute("SELECT questionnaire_type, completion_date FROM questionnaires WHERE patient_id = ?", (patient_id,))
-                    questionnaires = c.fetchall()
-                    completed_questionnaires = [q[0] for q in questionnaires]
-                    
-                    # Get dental examination status
-                    c.execute("SELECT exam_type, exam_date FROM dental_examination WHERE patient_id = ?", (patient_id,))
-                    examinations = c.fetchall()
-                    completed_exams = [e[0] for e in examinations]
-                    
-                    # Get clinical records
-                    c.execute("SELECT record_date FROM clinical_records WHERE patient_id = ?", (patient_id,))
-                    clinical_records = c.fetchall()
-                    
-                    # Get AI reports
-                    c.execute("SELECT generated_at FROM ai_reports WHERE patient_id = ?", (patient_id,))
-                    ai_reports = c.fetchall()
-                    
                     # Display completion status
                     st.write("---")
                     st.write("### Patient Progress")
@@ -606,15 +1735,10 @@ def patients_page():
                     col1, col2, col3, col4 = st.columns(4)
                     
                     with col1:
-                        medical_complete = "medical" in completed_questionnaires
-                        dental_complete = "dental" in completed_questionnaires
-                        allergies_complete = "allergies" in completed_questionnaires
-                        medications_complete = "medications" in completed_questionnaires
-                        
-                        questionnaire_count = sum([
-                            medical_complete, dental_complete, 
-                            allergies_complete, medications_complete
-                        ])
+                        medical_complete = "medical" in progress.questionnaires
+                        dental_complete = "dental" in progress.questionnaires
+                        allergies_complete = "allergies" in progress.questionnaires
+                        questionnaire_count = progress.questionnaire_count
                         
                         st.metric(
                             "Questionnaires", 
@@ -623,7 +1747,7 @@ def patients_page():
                         )
                     
                     with col2:
-                        exam_count = len(completed_exams)
+                        exam_count = progress.exam_count
                         st.metric(
                             "Dental Examinations", 
                             f"{exam_count}/4", 
@@ -631,7 +1755,7 @@ def patients_page():
                         )
                     
                     with col3:
-                        clinical_count = len(clinical_records)
+                        clinical_count = len(progress.clinical_record_dates)
                         st.metric(
                             "Clinical Interactions", 
                             clinical_count, 
@@ -639,7 +1763,7 @@ def patients_page():
                         )
                     
                     with col4:
-                        ai_count = len(ai_reports)
+                        ai_count = len(progress.ai_reports)
                         st.metric(
                             "AI Reports", 
                             ai_count, 
@@ -653,12 +1777,9 @@ def patients_page():
                         # Medical History
                         if medical_complete:
                             with st.expander("Medical History", expanded=False):
-                                c.execute("SELECT responses FROM questionnaires WHERE patient_id = ? AND questionnaire_type = 'medical'", (patient_id,))
-                                medical_data = c.fetchone()
-                                if medical_data:
+                                medical_responses = progress.questionnaires["medical"][0]
+                                if medical_responses:
                                     try:
-                                        medical_responses = safe_eval(medical_data[0])
-                                        
                                         st.write(f"**General Health:** {medical_responses.get('general_health', 'Not specified')}")
                                         
                                         # Medical conditions
@@ -686,12 +1807,9 @@ def patients_page():
                         # Dental History
                         if dental_complete:
                             with st.expander("Dental History", expanded=False):
-                                c.execute("SELECT responses FROM questionnaires WHERE patient_id = ? AND questionnaire_type = 'dental'", (patient_id,))
-                                dental_data = c.fetchone()
-                                if dental_data:
+                                dental_responses = progress.questionnaires["dental"][0]
+                                if dental_responses:
                                     try:
-                                        dental_responses = safe_eval(dental_data[0])
-                                        
                                         st.write(f"**Last Dental Visit:** {dental_responses.get('previous_care', {}).get('last_visit', 'Not specified')}")
                                         st.write(f"**Brushing Frequency:** {dental_responses.get('dental_habits', {}).get('brushing', 'Not specified')}")
                                         st.write(f"**Flossing Frequency:** {dental_responses.get('dental_habits', {}).get('flossing', 'Not specified')}")
@@ -727,12 +1845,9 @@ def patients_page():
                         # Allergies
                         if allergies_complete:
                             with st.expander("Allergies", expanded=False):
-                                c.execute("SELECT responses FROM questionnaires WHERE patient_id = ? AND questionnaire_type = 'allergies'", (patient_id,))
-                                allergies_data = c.fetchone()
-                                if allergies_data:
+                                allergies_responses = progress.questionnaires["allergies"][0]
+                                if allergies_responses:
                                     try:
-                                        allergies_responses = safe_eval(allergies_data[0])
-                                        
                                         # Medication allergies
                                         if allergies_responses.get('medication_allergies', {}).get('has_allergies', False):
                                             st.write("**Medication Allergies:** Yes")
@@ -760,13 +1875,10 @@ def patients_page():
                     if exam_count > 0:
                         st.write("### Examination Summary")
                         
-                        for exam_type in completed_exams:
+                        for exam_type, (findings, exam_date) in progress.examinations.items():
                             with st.expander(f"{exam_type.replace('_', ' ').title()} Examination", expanded=False):
-                                c.execute("SELECT findings FROM dental_examination WHERE patient_id = ? AND exam_type = ?", (patient_id, exam_type))
-                                exam_data = c.fetchone()
-                                if exam_data:
+                                if findings:
                                     try:
-                                        findings = safe_eval(exam_data[0])
                                         for key, value in findings.items():
                                             if isinstance(value, dict):
                                                 st.write(f"**{key.replace('_', ' ').title()}:**")
@@ -781,10 +1893,7 @@ def patients_page():
                     if ai_count > 0:
                         st.write("### AI Analysis Reports")
                         
-                        c.execute("SELECT report_text, generated_at FROM ai_reports WHERE patient_id = ? ORDER BY generated_at DESC", (patient_id,))
-                        reports = c.fetchall()
-                        
-                        for i, report in enumerate(reports):
+                        for i, report in enumerate(progress.ai_reports):
                             with st.expander(f"AI Report {i+1} - {report[1]}", expanded=False):
                                 st.markdown(report[0])
                     
@@ -794,8 +1903,6 @@ def patients_page():
                         st.rerun()
                 else:
                     st.error("Patient not found")
-                
-                conn.close()
             except Exception as e:
                 st.error(f"Error retrieving patient details: {str(e)}")
     
@@ -831,25 +1938,11 @@ def patients_page():
                     st.error("First name and last name are required fields.")
                 else:
                     try:
-                        # Connect to database
-                        conn = sqlite3.connect('data/dentai.db')
-                        c = conn.cursor()
-                        
                         # Format date of birth
                         dob_str = dob.strftime("%Y-%m-%d") if dob else None
                         
                         # Insert new patient
-                        c.execute('''
-                        INSERT INTO patients (first_name, last_name, date_of_birth, gender, phone, email, address)
-                        VALUES (?, ?, ?, ?, ?, ?, ?)
-                        ''', (first_name, last_name, dob_str, gender, phone, email, address))
-                        
-                        # Get the ID of the newly inserted patient
-                        new_patient_id = c.lastrowid
-                        
-                        # Commit changes
-                        conn.commit()
-                        conn.close()
+                        new_patient_id = save_patient(first_name, last_name, dob_str, gender, phone, email, address)
                         
                         # Show success message and clear form (by rerunning)
                         st.success(f"Patient {first_name} {last_name} added successfully!")
@@ -866,36 +1959,29 @@ def patients_page():
     # Search Patient Tab
     with tab3:
         st.subheader("Search Patient")
-        search_term = st.text_input("Enter patient name, ID, or phone number")
+        search_term = st.text_input(
+            "Enter patient name, ID, phone number or clinical terms",
+            help='Words match as prefixes; use "double quotes" for an exact phrase.'
+        )
         
         if search_term:
             try:
-                conn = sqlite3.connect('data/dentai.db')
-                search_results = pd.read_sql_query(
-                    """
-                    SELECT id, first_name, last_name, date_of_birth, gender, phone, email
-                    FROM patients
-                    WHERE first_name LIKE ? 
-                    OR last_name LIKE ?
-                    OR phone LIKE ?
-                    OR CAST(id AS VARCHAR) = ?
-                    ORDER BY last_name, first_name
-                    """,
-                    conn,
-                    params=(f"%{search_term}%", f"%{search_term}%", f"%{search_term}%", search_term)
-                )
-                conn.close()
+                search_results = search_records(search_term)
+                
+                if search_results.empty:
+                    # Nothing matched as typed; try names that look or sound alike
+                    search_results = find_similar_patients(search_term)
+                    if not search_results.empty:
+                        st.write("No exact matches. Patients with similar names:")
+                        st.dataframe(search_results, hide_index=True)
+                else:
+                    st.write(f"Found {len(search_results)} matching records:")
+                    st.dataframe(search_results, hide_index=True)
                 
                 if not search_results.empty:
-                    st.write(f"Found {len(search_results)} matching patients:")
-                    st.dataframe(search_results)
                     
                     # Select patient for actions
-                    patient_id = st.selectbox(
-                        "Select a patient for actions:",
-                        search_results['id'].tolist(),
-                        format_func=lambda x: f"{search_results[search_results['id'] == x]['first_name'].iloc[0]} {search_results[search_results['id'] == x]['last_name'].iloc[0]}"
-                    )
+                    patient_id = patient_picker("Select a patient for actions:", search_results, key="search_patient")
                     
                     col1, col2, col3, col4 = st.columns(4)
                     
@@ -929,6 +2015,49 @@ def patients_page():
             except Exception as e:
                 st.error(f"Error searching for patients: {str(e)}")
 
+    # Patient Progress Tab
+    with tab4:
+        st.subheader("Patient Progress")
+        try:
+            # Same keyset pages as the patient list, so each rerun loads one page of progress
+            if 'patient_progress_pages' not in st.session_state:
+                st.session_state.patient_progress_pages = [None]
+            page_cursors = st.session_state.patient_progress_pages
+
+            patients_df, next_cursor = list_patients(after=page_cursors[-1])
+            progress = load_patient_progress(patients_df['id'].tolist())
+            page = [(patient_id, progress[patient_id]) for patient_id in patients_df['id'].tolist() if patient_id in progress]
+
+            if page:
+                progress_df = pd.DataFrame([
+                    {
+                        "ID": patient_id,
+                        "Name": f"{entry.patient[1]} {entry.patient[2]}",
+                        "Questionnaires": f"{entry.questionnaire_count}/4",
+                        "Examinations": f"{entry.exam_count}/4",
+                        "Clinical Interactions": len(entry.clinical_record_dates),
+                        "AI Reports": len(entry.ai_reports),
+                    }
+                    for patient_id, entry in page
+                ])
+                st.dataframe(progress_df, hide_index=True)
+
+                col1, col2, col3 = st.columns([1, 1, 4])
+                with col1:
+                    if st.button("← Previous", key="patient_progress_prev", disabled=len(page_cursors) == 1):
+                        page_cursors.pop()
+                        st.rerun()
+                with col2:
+                    if st.button("Next →", key="patient_progress_next", disabled=next_cursor is None):
+                        page_cursors.append(next_cursor)
+                        st.rerun()
+                with col3:
+                    st.write(f"Page {len(page_cursors)}")
+            else:
+                st.info("No patients found. Add patients to get started.")
+        except Exception as e:
+            st.error(f"Error retrieving patient progress: {str(e)}")
+
 def dental_examination_page():
     st.title("DentAI - Dental Examination")
     
@@ -1013,11 +2142,7 @@ def dental_examination_page():
     
     # Get patient info
     patient_id = st.session_state.selected_patient
-    conn = sqlite3.connect('data/dentai.db')
-    c = conn.cursor()
-    c.execute("SELECT first_name, last_name FROM patients WHERE id = ?", (patient_id,))
-    patient = c.fetchone()
-    conn.close()
+    patient = get_db_pool().query_one("SELECT first_name, last_name FROM patients WHERE id = ?", (patient_id,))
     
     if not patient:
         st.error("Patient not found")
@@ -1077,28 +2202,7 @@ def dental_examination_page():
                 
                 # Save to database
                 try:
-                    conn = sqlite3.connect('data/dentai.db')
-                    c = conn.cursor()
-                    
-                    # Check if a record already exists for this patient
-                    c.execute("SELECT id FROM dental_examination WHERE patient_id = ? AND exam_type = 'extraoral'", (patient_id,))
-                    existing = c.fetchone()
-                    
-                    if existing:
-                        # Update existing record
-                        c.execute(
-                            "UPDATE dental_examination SET findings = ?, exam_date = CURRENT_TIMESTAMP WHERE id = ?",
-                            (str(responses).replace("'", "''"), existing[0])
-                        )
-                    else:
-                        # Insert new record
-                        c.execute(
-                            "INSERT INTO dental_examination (patient_id, exam_type, findings) VALUES (?, ?, ?)",
-                            (patient_id, "extraoral", str(responses).replace("'", "''"))
-                        )
-                    
-                    conn.commit()
-                    conn.close()
+                    save_examination(patient_id, "extraoral", responses)
                     st.success("Extraoral examination saved successfully!")
                 except Exception as e:
                     st.error(f"Error saving examination: {str(e)}")
@@ -1170,28 +2274,7 @@ def dental_examination_page():
                 
                 # Save to database
                 try:
-                    conn = sqlite3.connect('data/dentai.db')
-                    c = conn.cursor()
-                    
-                    # Check if a record already exists for this patient
-                    c.execute("SELECT id FROM dental_examination WHERE patient_id = ? AND exam_type = 'intraoral'", (patient_id,))
-                    existing = c.fetchone()
-                    
-                    if existing:
-                        # Update existing record
-                        c.execute(
-                            "UPDATE dental_examination SET findings = ?, exam_date = CURRENT_TIMESTAMP WHERE id = ?",
-                            (str(responses).replace("'", "''"), existing[0])
-                        )
-                    else:
-                        # Insert new record
-                        c.execute(
-                            "INSERT INTO dental_examination (patient_id, exam_type, findings) VALUES (?, ?, ?)",
-                            (patient_id, "intraoral", str(responses).replace("'", "''"))
-                        )
-                    
-                    conn.commit()
-                    conn.close()
+                    save_examination(patient_id, "intraoral", responses)
                     st.success("Intraoral examination saved successfully!")
                 except Exception as e:
                     st.error(f"Error saving examination: {str(e)}")
@@ -1247,28 +2330,7 @@ def dental_examination_page():
                 
                 # Save to database
                 try:
-                    conn = sqlite3.connect('data/dentai.db')
-                    c = conn.cursor()
-                    
-                    # Check if a record already exists for this patient
-                    c.execute("SELECT id FROM dental_examination WHERE patient_id = ? AND exam_type = 'charting'", (patient_id,))
-                    existing = c.fetchone()
-                    
-                    if existing:
-                        # Update existing record
-                        c.execute(
-                            "UPDATE dental_examination SET findings = ?, exam_date = CURRENT_TIMESTAMP WHERE id = ?",
-                            (str(responses).replace("'", "''"), existing[0])
-                        )
-                    else:
-                        # Insert new record
-                        c.execute(
-                            "INSERT INTO dental_examination (patient_id, exam_type, findings) VALUES (?, ?, ?)",
-                            (patient_id, "charting", str(responses).replace("'", "''"))
-                        )
-                    
-                    conn.commit()
-                    conn.close()
+                    save_examination(patient_id, "charting", responses)
                     st.success("Dental charting saved successfully!")
                 except Exception as e:
                     st.error(f"Error saving dental charting: {str(e)}")
@@ -1341,31 +2403,10 @@ def dental_examination_page():
                         "notes": furcation_notes
                     }
                 }
-                
-                # Save to database
-                try:
-                    conn = sqlite3.connect('data/dentai.db')
-                    c = conn.cursor()
-                    
-                    # Check if a record already exists for this patient
-                    c.execute("SELECT id FROM dental_examination WHERE patient_id = ? AND exam_type = 'periodontal'", (patient_id,))
-                    existing = c.fetchone()
-                    
-                    if existing:
-                        # Update existing record
-                        c.execute(
-                            "UPDATE dental_examination SET findings = ?, exam_date = CURRENT_TIMESTAMP WHERE id = ?",
-                            (str(responses).replace("'", "''"), existing[0])
-                        )
-                    else:
-                        # Insert new record
-                        c.execute(
-                            "INSERT INTO dental_examination (patient_id, exam_type, findings) VALUES (?, ?, ?)",
-                            (patient_id, "periodontal", str(responses).replace("'", "''"))
-                        )
-                    
-                    conn.commit()
-                    conn.close()
+                
+                # Save to database
+                try:
+                    save_examination(patient_id, "periodontal", responses)
                     st.success("Periodontal assessment saved successfully!")
                 except Exception as e:
                     st.error(f"Error saving periodontal assessment: {str(e)}")
@@ -1376,20 +2417,14 @@ def dental_examination_page():
         
         # Fetch all examination data
         try:
-            conn = sqlite3.connect('data/dentai.db')
-            c = conn.cursor()
-            
             # Get all examination records for this patient
-            c.execute("""
+            exams = get_db_pool().query("""
             SELECT exam_type, findings, exam_date 
             FROM dental_examination 
             WHERE patient_id = ? 
             ORDER BY exam_type, exam_date DESC
             """, (patient_id,))
             
-            exams = c.fetchall()
-            conn.close()
-            
             if exams:
                 st.write("### Dental Examination Summary")
                 
@@ -1407,7 +2442,7 @@ def dental_examination_page():
                 for exam_type, data in exam_data.items():
                     with st.expander(f"{exam_type.title()} Examination ({data['date']})"):
                         try:
-                            findings = safe_eval(data['findings'])
+                            findings = decode_json(data['findings'])
                             st.json(findings)
                         except:
                             st.write("Error parsing examination data")
@@ -1443,14 +2478,12 @@ def dental_examination_page():
                     
                     # Save AI analysis to database
                     try:
-                        conn = sqlite3.connect('data/dentai.db')
-                        c = conn.cursor()
-                        c.execute(
-                            "INSERT INTO ai_reports (patient_id, report_text) VALUES (?, ?)",
-                            (patient_id, ai_analysis)
-                        )
-                        conn.commit()
-                        conn.close()
+                        with get_db_pool().transaction() as conn:
+                            c = conn.cursor()
+                            c.execute(
+                                "INSERT INTO ai_reports (patient_id, report_text) VALUES (?, ?)",
+                                (patient_id, ai_analysis)
+                            )
                         
                         st.success("Dental analysis generated successfully!")
                         st.markdown(ai_analysis)
@@ -1512,11 +2545,7 @@ def questionnaire_page():
     
     # Get patient info
     patient_id = st.session_state.selected_patient
-    conn = sqlite3.connect('data/dentai.db')
-    c = conn.cursor()
-    c.execute("SELECT first_name, last_name FROM patients WHERE id = ?", (patient_id,))
-    patient = c.fetchone()
-    conn.close()
+    patient = get_db_pool().query_one("SELECT first_name, last_name FROM patients WHERE id = ?", (patient_id,))
     
     if not patient:
         st.error("Patient not found")
@@ -1601,7 +2630,7 @@ def questionnaire_page():
                 
                 # Initialize OpenAI client
                 if st.session_state.openai_api_key:
-                    client = OpenAI(api_key=st.session_state.openai_api_key)
+                    client = get_openai_client(st.session_state.openai_api_key)
                 else:
                     st.warning("OpenAI API key is not configured. Using simulated transcription instead.")
                     client = None
@@ -1628,24 +2657,7 @@ def questionnaire_page():
                 st.write(transcription_text)
                 
                 # Save transcription to database
-                conn = sqlite3.connect('data/dentai.db')
-                c = conn.cursor()
-                
-                # Check if a record already exists for this patient
-                c.execute("SELECT id FROM clinical_records WHERE patient_id = ?", (patient_id,))
-                existing_id = c.fetchone()
-                
-                if existing_id:
-                    # Update existing record
-                    c.execute("UPDATE clinical_records SET transcription = ?, record_date = CURRENT_TIMESTAMP WHERE id = ?", 
-                             (transcription_text, existing_id[0]))
-                else:
-                    # Insert new record
-                    c.execute("INSERT INTO clinical_records (patient_id, transcription, record_date) VALUES (?, ?, CURRENT_TIMESTAMP)",
-                             (patient_id, transcription_text))
-                
-                conn.commit()
-                conn.close()
+                save_clinical_record(patient_id, touch_date=True, transcription=transcription_text)
                 
                 st.success("Transcription saved to database!")
                 
@@ -1665,24 +2677,7 @@ def questionnaire_page():
                     st.markdown(ai_report)
                     
                     # Save AI analysis to database
-                    conn = sqlite3.connect('data/dentai.db')
-                    c = conn.cursor()
-                    
-                    # Update the same record with AI analysis
-                    c.execute("SELECT id FROM clinical_records WHERE patient_id = ?", (patient_id,))
-                    existing_id = c.fetchone()
-                    
-                    if existing_id:
-                        # Update existing record
-                        c.execute("UPDATE clinical_records SET ai_analysis = ? WHERE id = ?", 
-                                (ai_report, existing_id[0]))
-                    else:
-                        # This shouldn't happen as we just created a record, but just in case
-                        c.execute("INSERT INTO clinical_records (patient_id, ai_analysis) VALUES (?, ?)",
-                                (patient_id, ai_report))
-                    
-                    conn.commit()
-                    conn.close()
+                    save_clinical_record(patient_id, ai_analysis=ai_report)
                     
                     st.success("AI Analysis saved to database!")
                     
@@ -1737,24 +2732,7 @@ def questionnaire_page():
                 
                 # Save transcription to database even in case of error
                 try:
-                    conn = sqlite3.connect('data/dentai.db')
-                    c = conn.cursor()
-                    
-                    # Check if a record already exists for this patient
-                    c.execute("SELECT id FROM clinical_records WHERE patient_id = ?", (patient_id,))
-                    existing_id = c.fetchone()
-                    
-                    if existing_id:
-                        # Update existing record
-                        c.execute("UPDATE clinical_records SET transcription = ?, record_date = CURRENT_TIMESTAMP WHERE id = ?", 
-                                (transcription_text, existing_id[0]))
-                    else:
-                        # Insert new record
-                        c.execute("INSERT INTO clinical_records (patient_id, transcription, record_date) VALUES (?, ?, CURRENT_TIMESTAMP)",
-                                (patient_id, transcription_text))
-                    
-                    conn.commit()
-                    conn.close()
+                    save_clinical_record(patient_id, touch_date=True, transcription=transcription_text)
                     
                     st.success("Fallback transcription saved to database!")
                 except Exception as db_error:
@@ -1839,28 +2817,7 @@ def questionnaire_page():
                 
                 # Save to database
                 try:
-                    conn = sqlite3.connect('data/dentai.db')
-                    c = conn.cursor()
-                    
-                    # Check if a questionnaire already exists for this patient
-                    c.execute("SELECT id FROM questionnaires WHERE patient_id = ? AND questionnaire_type = 'medical'", (patient_id,))
-                    existing = c.fetchone()
-                    
-                    if existing:
-                        # Update existing questionnaire
-                        c.execute(
-                            "UPDATE questionnaires SET responses = ?, completion_date = CURRENT_TIMESTAMP WHERE id = ?",
-                            (str(medical_data).replace("'", "''"), existing[0])
-                        )
-                    else:
-                        # Insert new questionnaire
-                        c.execute(
-                            "INSERT INTO questionnaires (patient_id, questionnaire_type, responses, completion_date) VALUES (?, ?, ?, CURRENT_TIMESTAMP)",
-                            (patient_id, 'medical', str(medical_data).replace("'", "''"))
-                        )
-                    
-                    conn.commit()
-                    conn.close()
+                    save_questionnaire(patient_id, "medical", medical_data)
                     st.success("Medical history saved successfully!")
                 except Exception as e:
                     st.error(f"Error saving medical history: {str(e)}")
@@ -1974,28 +2931,7 @@ def questionnaire_page():
                 
                 # Save to database
                 try:
-                    conn = sqlite3.connect('data/dentai.db')
-                    c = conn.cursor()
-                    
-                    # Check if a questionnaire already exists for this patient
-                    c.execute("SELECT id FROM questionnaires WHERE patient_id = ? AND questionnaire_type = 'dental'", (patient_id,))
-                    existing = c.fetchone()
-                    
-                    if existing:
-                        # Update existing questionnaire
-                        c.execute(
-                            "UPDATE questionnaires SET responses = ?, completion_date = CURRENT_TIMESTAMP WHERE id = ?",
-                            (str(dental_data).replace("'", "''"), existing[0])
-                        )
-                    else:
-                        # Insert new questionnaire
-                        c.execute(
-                            "INSERT INTO questionnaires (patient_id, questionnaire_type, responses, completion_date) VALUES (?, ?, ?, CURRENT_TIMESTAMP)",
-                            (patient_id, 'dental', str(dental_data).replace("'", "''"))
-                        )
-                    
-                    conn.commit()
-                    conn.close()
+                    save_questionnaire(patient_id, "dental", dental_data)
                     st.success("Dental history saved successfully!")
                 except Exception as e:
                     st.error(f"Error saving dental history: {str(e)}")
@@ -2058,28 +2994,7 @@ def questionnaire_page():
                 
                 # Save to database
                 try:
-                    conn = sqlite3.connect('data/dentai.db')
-                    c = conn.cursor()
-                    
-                    # Check if a questionnaire already exists for this patient
-                    c.execute("SELECT id FROM questionnaires WHERE patient_id = ? AND questionnaire_type = 'allergies'", (patient_id,))
-                    existing = c.fetchone()
-                    
-                    if existing:
-                        # Update existing questionnaire
-                        c.execute(
-                            "UPDATE questionnaires SET responses = ?, completion_date = CURRENT_TIMESTAMP WHERE id = ?",
-                            (str(allergies_data).replace("'", "''"), existing[0])
-                        )
-                    else:
-                        # Insert new questionnaire
-                        c.execute(
-                            "INSERT INTO questionnaires (patient_id, questionnaire_type, responses, completion_date) VALUES (?, ?, ?, CURRENT_TIMESTAMP)",
-                            (patient_id, 'allergies', str(allergies_data).replace("'", "''"))
-                        )
-                    
-                    conn.commit()
-                    conn.close()
+                    save_questionnaire(patient_id, "allergies", allergies_data)
                     st.success("Allergies saved successfully!")
                 except Exception as e:
                     st.error(f"Error saving allergies: {str(e)}")
@@ -2146,28 +3061,7 @@ def questionnaire_page():
                 
                 # Save to database
                 try:
-                    conn = sqlite3.connect('data/dentai.db')
-                    c = conn.cursor()
-                    
-                    # Check if a questionnaire already exists for this patient
-                    c.execute("SELECT id FROM questionnaires WHERE patient_id = ? AND questionnaire_type = 'medications'", (patient_id,))
-                    existing = c.fetchone()
-                    
-                    if existing:
-                        # Update existing questionnaire
-                        c.execute(
-                            "UPDATE questionnaires SET responses = ?, completion_date = CURRENT_TIMESTAMP WHERE id = ?",
-                            (str(medications_data).replace("'", "''"), existing[0])
-                        )
-                    else:
-                        # Insert new questionnaire
-                        c.execute(
-                            "INSERT INTO questionnaires (patient_id, questionnaire_type, responses, completion_date) VALUES (?, ?, ?, CURRENT_TIMESTAMP)",
-                            (patient_id, 'medications', str(medications_data).replace("'", "''"))
-                        )
-                    
-                    conn.commit()
-                    conn.close()
+                    save_questionnaire(patient_id, "medications", medications_data)
                     st.success("Medications saved successfully!")
                 except Exception as e:
                     st.error(f"Error saving medications: {str(e)}")
@@ -2240,28 +3134,7 @@ def questionnaire_page():
                 
                 # Save to database
                 try:
-                    conn = sqlite3.connect('data/dentai.db')
-                    c = conn.cursor()
-                    
-                    # Check if a questionnaire already exists for this patient
-                    c.execute("SELECT id FROM questionnaires WHERE patient_id = ? AND questionnaire_type = 'lifestyle'", (patient_id,))
-                    existing = c.fetchone()
-                    
-                    if existing:
-                        # Update existing questionnaire
-                        c.execute(
-                            "UPDATE questionnaires SET responses = ?, completion_date = CURRENT_TIMESTAMP WHERE id = ?",
-                            (str(lifestyle_data).replace("'", "''"), existing[0])
-                        )
-                    else:
-                        # Insert new questionnaire
-                        c.execute(
-                            "INSERT INTO questionnaires (patient_id, questionnaire_type, responses, completion_date) VALUES (?, ?, ?, CURRENT_TIMESTAMP)",
-                            (patient_id, 'lifestyle', str(lifestyle_data).replace("'", "''"))
-                        )
-                    
-                    conn.commit()
-                    conn.close()
+                    save_questionnaire(patient_id, "lifestyle", lifestyle_data)
                     st.success("Lifestyle information saved successfully!")
                 except Exception as e:
                     st.error(f"Error saving lifestyle information: {str(e)}")
@@ -2271,11 +3144,7 @@ def questionnaire_page():
         st.subheader("Women's Health")
         
         # Check if patient is female
-        conn = sqlite3.connect('data/dentai.db')
-        c = conn.cursor()
-        c.execute("SELECT gender FROM patients WHERE id = ?", (patient_id,))
-        gender_data = c.fetchone()
-        conn.close()
+        gender_data = get_db_pool().query_one("SELECT gender FROM patients WHERE id = ?", (patient_id,))
         
         if gender_data and gender_data[0] and gender_data[0].lower() == 'female':
             with st.form("womens_health_form"):
@@ -2339,28 +3208,7 @@ def questionnaire_page():
                     
                     # Save to database
                     try:
-                        conn = sqlite3.connect('data/dentai.db')
-                        c = conn.cursor()
-                        
-                        # Check if a questionnaire already exists for this patient
-                        c.execute("SELECT id FROM questionnaires WHERE patient_id = ? AND questionnaire_type = 'womens_health'", (patient_id,))
-                        existing = c.fetchone()
-                        
-                        if existing:
-                            # Update existing questionnaire
-                            c.execute(
-                                "UPDATE questionnaires SET responses = ?, completion_date = CURRENT_TIMESTAMP WHERE id = ?",
-                                (str(womens_health_data).replace("'", "''"), existing[0])
-                            )
-                        else:
-                            # Insert new questionnaire
-                            c.execute(
-                                "INSERT INTO questionnaires (patient_id, questionnaire_type, responses, completion_date) VALUES (?, ?, ?, CURRENT_TIMESTAMP)",
-                                (patient_id, 'womens_health', str(womens_health_data).replace("'", "''"))
-                            )
-                        
-                        conn.commit()
-                        conn.close()
+                        save_questionnaire(patient_id, "womens_health", womens_health_data)
                         st.success("Women's health information saved successfully!")
                     except Exception as e:
                         st.error(f"Error saving women's health information: {str(e)}")
@@ -2377,58 +3225,55 @@ def questionnaire_page():
         if 'current_analysis' not in st.session_state:
             st.session_state.current_analysis = None
         
-        # Create new connection to avoid closed database issues
+        # Read all questionnaire data on one pooled connection
         questionnaire_data = {}
         try:
-            questionnaire_conn = sqlite3.connect('data/dentai.db')
-            questionnaire_cursor = questionnaire_conn.cursor()
-            
-            # Get medical questionnaire data
-            questionnaire_cursor.execute(
-                "SELECT responses FROM medical_questionnaires WHERE patient_id = ? ORDER BY visit_date DESC LIMIT 1", 
-                (patient_id,)
-            )
-            medical_data = questionnaire_cursor.fetchone()
-            if medical_data and medical_data[0]:
-                questionnaire_data['medical'] = safe_eval(medical_data[0])
-            
-            # Get dental history data
-            questionnaire_cursor.execute("SELECT * FROM dental_history WHERE patient_id = ?", (patient_id,))
-            dental_history = questionnaire_cursor.fetchone()
-            if dental_history:
-                dental_history_dict = {}
-                dental_history_dict['last_dental_visit'] = dental_history[2]
-                dental_history_dict['reason_for_last_visit'] = dental_history[3]
-                dental_history_dict['previous_dentist'] = dental_history[4]
-                dental_history_dict['brushing_frequency'] = dental_history[5]
-                dental_history_dict['flossing_frequency'] = dental_history[6]
-                dental_history_dict['sensitivity'] = dental_history[7]
-                dental_history_dict['grinding_clenching'] = dental_history[8]
-                questionnaire_data['dental_history'] = dental_history_dict
-            
-            # Get allergies data
-            questionnaire_cursor.execute("SELECT * FROM allergies WHERE patient_id = ?", (patient_id,))
-            allergies_data = questionnaire_cursor.fetchone()
-            if allergies_data:
-                allergies_dict = {
-                    'analgesics': allergies_data[2] == 1,
-                    'antibiotics': allergies_data[3] == 1,
-                    'latex': allergies_data[4] == 1,
-                    'metals': allergies_data[5] == 1,
-                    'dental_materials': allergies_data[6] == 1,
-                    'other': allergies_data[7]
-                }
-                questionnaire_data['allergies'] = allergies_dict
-            
-            # Get questionnaire data
-            questionnaire_cursor.execute("SELECT questionnaire_type, responses FROM questionnaires WHERE patient_id = ?", (patient_id,))
-            questionnaire_rows = questionnaire_cursor.fetchall()
-            for q_type, responses in questionnaire_rows:
-                if responses:
-                    questionnaire_data[q_type] = safe_eval(responses)
-            
-            # Close this specific connection after retrieving data
-            questionnaire_conn.close()
+            with get_db_pool().connection() as questionnaire_conn:
+                questionnaire_cursor = questionnaire_conn.cursor()
+                
+                # Get medical questionnaire data
+                questionnaire_cursor.execute(
+                    "SELECT responses FROM medical_questionnaires WHERE patient_id = ? ORDER BY visit_date DESC LIMIT 1", 
+                    (patient_id,)
+                )
+                medical_data = questionnaire_cursor.fetchone()
+                if medical_data and medical_data[0]:
+                    questionnaire_data['medical'] = decode_json(medical_data[0])
+                
+                # Get dental history data
+                questionnaire_cursor.execute("SELECT * FROM dental_history WHERE patient_id = ?", (patient_id,))
+                dental_history = questionnaire_cursor.fetchone()
+                if dental_history:
+                    dental_history_dict = {}
+                    dental_history_dict['last_dental_visit'] = dental_history[2]
+                    dental_history_dict['reason_for_last_visit'] = dental_history[3]
+                    dental_history_dict['previous_dentist'] = dental_history[4]
+                    dental_history_dict['brushing_frequency'] = dental_history[5]
+                    dental_history_dict['flossing_frequency'] = dental_history[6]
+                    dental_history_dict['sensitivity'] = dental_history[7]
+                    dental_history_dict['grinding_clenching'] = dental_history[8]
+                    questionnaire_data['dental_history'] = dental_history_dict
+                
+                # Get allergies data
+                questionnaire_cursor.execute("SELECT * FROM allergies WHERE patient_id = ?", (patient_id,))
+                allergies_data = questionnaire_cursor.fetchone()
+                if allergies_data:
+                    allergies_dict = {
+                        'analgesics': allergies_data[2] == 1,
+                        'antibiotics': allergies_data[3] == 1,
+                        'latex': allergies_data[4] == 1,
+                        'metals': allergies_data[5] == 1,
+                        'dental_materials': allergies_data[6] == 1,
+                        'other': allergies_data[7]
+                    }
+                    questionnaire_data['allergies'] = allergies_dict
+                
+                # Get questionnaire data
+                questionnaire_cursor.execute("SELECT questionnaire_type, responses FROM questionnaires WHERE patient_id = ?", (patient_id,))
+                questionnaire_rows = questionnaire_cursor.fetchall()
+                for q_type, responses in questionnaire_rows:
+                    if responses:
+                        questionnaire_data[q_type] = decode_json(responses)
         except Exception as e:
             st.error(f"Error retrieving questionnaire data: {e}")
             st.info("Try going back to the Medical History tab and entering some information before using the AI Analysis.")
@@ -2524,6 +3369,9 @@ def settings_page():
     
     if st.button("Save API Key"):
         st.session_state.openai_api_key = api_key
+        # Validate the key in the background so the first analysis does not wait for it
+        if api_key:
+            get_api_health_probe().refresh_async(api_key.strip())
         st.success("API key saved successfully!")
     
     # Display API status
@@ -2531,7 +3379,22 @@ def settings_page():
         st.info("OpenAI API key is configured. AI features are available.")
     else:
         st.warning("OpenAI API key is not configured. AI features will be limited to simulated responses.")
-    
+
+    # AI response caches
+    st.subheader("AI Response Caches")
+    cache = llm_cache_summary()
+    lookups = cache["hits"] + cache["misses"]
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Cached analyses", cache["entries"])
+    col2.metric("Cache size", f"{cache['bytes'] / (1024 * 1024):.1f} MB")
+    col3.metric("Hit rate", f"{cache['hits'] / lookups:.0%}" if lookups else "n/a")
+
+    transcripts = get_db_pool().query_one("SELECT COUNT(*) FROM transcription_cache")[0]
+    hits, misses = cache_lookup_counts("transcription")
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Cached transcriptions", transcripts)
+    col3.metric("Transcription hit rate", f"{hits / (hits + misses):.0%}" if hits + misses else "n/a")
+
     # Instructions
     st.write("---")
     st.header("Instructions")
@@ -2603,10 +3466,8 @@ def clinical_interaction_page():
     
     # Get patient info
     patient_id = st.session_state.selected_patient
-    conn = sqlite3.connect('data/dentai.db')
-    c = conn.cursor()
-    c.execute("SELECT first_name, last_name FROM patients WHERE id = ?", (patient_id,))
-    patient = c.fetchone()
+    db = get_db_pool()
+    patient = db.query_one("SELECT first_name, last_name FROM patients WHERE id = ?", (patient_id,))
     
     if not patient:
         st.error("Patient not found")
@@ -2623,8 +3484,7 @@ def clinical_interaction_page():
         st.subheader("Chief Complaint")
         
         # Check if there's an existing chief complaint
-        c.execute("SELECT chief_complaint FROM clinical_records WHERE patient_id = ?", (patient_id,))
-        existing_complaint = c.fetchone()
+        existing_complaint = db.query_one("SELECT chief_complaint FROM clinical_records WHERE patient_id = ?", (patient_id,))
         
         if existing_complaint and existing_complaint[0]:
             st.write("#### Current Chief Complaint")
@@ -2641,14 +3501,8 @@ def clinical_interaction_page():
                 submitted = st.form_submit_button("Save Chief Complaint")
                 if submitted and chief_complaint:
                     try:
-                        if existing_complaint:
-                            c.execute("UPDATE clinical_records SET chief_complaint = ? WHERE patient_id = ?", 
-                                     (chief_complaint, patient_id))
-                        else:
-                            c.execute("INSERT INTO clinical_records (patient_id, chief_complaint) VALUES (?, ?)",
-                                     (patient_id, chief_complaint))
+                        save_clinical_record(patient_id, chief_complaint=chief_complaint)
                         
-                        conn.commit()
                         st.success("Chief complaint saved successfully!")
                         
                         # Clear update flag if it exists
@@ -2664,8 +3518,7 @@ def clinical_interaction_page():
         st.subheader("Clinical Notes")
         
         # Check if there are existing clinical notes
-        c.execute("SELECT clinical_notes FROM clinical_records WHERE patient_id = ?", (patient_id,))
-        existing_notes = c.fetchone()
+        existing_notes = db.query_one("SELECT clinical_notes FROM clinical_records WHERE patient_id = ?", (patient_id,))
         
         if existing_notes and existing_notes[0]:
             st.write("#### Current Clinical Notes")
@@ -2682,14 +3535,8 @@ def clinical_interaction_page():
                 submitted = st.form_submit_button("Save Clinical Notes")
                 if submitted and clinical_notes:
                     try:
-                        if existing_notes:
-                            c.execute("UPDATE clinical_records SET clinical_notes = ? WHERE patient_id = ?", 
-                                     (clinical_notes, patient_id))
-                        else:
-                            c.execute("INSERT INTO clinical_records (patient_id, clinical_notes) VALUES (?, ?)",
-                                     (patient_id, clinical_notes))
+                        save_clinical_record(patient_id, clinical_notes=clinical_notes)
                         
-                        conn.commit()
                         st.success("Clinical notes saved successfully!")
                         
                         # Clear update flag if it exists
@@ -2711,8 +3558,7 @@ def clinical_interaction_page():
             st.session_state.current_analysis = None
         
         # Check if there's an existing transcription
-        c.execute("SELECT transcription, audio_file_path FROM clinical_records WHERE patient_id = ?", (patient_id,))
-        existing_record = c.fetchone()
+        existing_record = db.query_one("SELECT transcription, audio_file_path FROM clinical_records WHERE patient_id = ?", (patient_id,))
         
         # Display existing recordings if available
         if existing_record and existing_record[0]:
@@ -2737,6 +3583,10 @@ def clinical_interaction_page():
                 st.session_state.conversation_text = ""
                 st.session_state.current_analysis = None
         
+        # Transcription and analysis run as background jobs polled by this page
+        transcription_job = get_job_queue().latest("transcription", patient_id)
+        analysis_job = None
+        
         # Create tabs for recording and uploading
         record_tabs = st.tabs(["Record Audio", "Upload Audio"])
         
@@ -3185,65 +4035,42 @@ def clinical_interaction_page():
                     # Make sure we have an API key
                     if 'openai_api_key' not in st.session_state or not st.session_state.openai_api_key:
                         st.warning("Please enter your OpenAI API key in the Settings page first")
+                    elif transcription_job and transcription_job.active:
+                        st.info("A transcription for this patient is already in progress.")
                     else:
-                        with st.spinner("Transcribing..."):
-                            # Save the uploaded file
-                            timestamp = int(time.time())
-                            audio_file_path = f"data/audio/uploaded_{patient_id}_{timestamp}.{uploaded_file.name.split('.')[-1]}"
-                            
-                            # Ensure directory exists
-                            os.makedirs(os.path.dirname(audio_file_path), exist_ok=True)
-                            
-                            # Save the file
+                        # Save the uploaded file, named by content so re-uploads reuse it
+                        audio_bytes = uploaded_file.getvalue()
+                        audio_sha256 = hashlib.sha256(audio_bytes).hexdigest()
+                        audio_file_path = f"data/audio/uploaded_{patient_id}_{audio_sha256[:16]}.{uploaded_file.name.split('.')[-1]}"
+                        
+                        # Ensure directory exists
+                        os.makedirs(os.path.dirname(audio_file_path), exist_ok=True)
+                        
+                        # Save the file
+                        if not os.path.exists(audio_file_path):
                             with open(audio_file_path, "wb") as f:
-                                f.write(uploaded_file.getbuffer())
-                            
-                            # Reset file pointer to beginning
-                            uploaded_file.seek(0)
-                            
-                            # Transcribe the audio using OpenAI Whisper API
-                            try:
-                                # Call Whisper API
-                                headers = {
-                                    "Authorization": f"Bearer {st.session_state.openai_api_key}"
-                                }
-                                
-                                files = {
-                                    "file": uploaded_file,
-                                    "model": (None, "whisper-1"),
-                                }
-                                
-                                response = requests.post(
-                                    "https://api.openai.com/v1/audio/transcriptions",
-                                    headers=headers,
-                                    files=files
-                                )
-                                
-                                if response.status_code == 200:
-                                    transcription = response.json()["text"]
-                                    st.session_state.conversation_text = transcription
-                                    
-                                    # Save transcription to database
-                                    try:
-                                        c.execute("SELECT id FROM clinical_records WHERE patient_id = ?", (patient_id,))
-                                        existing_id = c.fetchone()
-                                        
-                                        if existing_id:
-                                            c.execute("UPDATE clinical_records SET transcription = ?, audio_file_path = ? WHERE id = ?", 
-                                                    (transcription, audio_file_path, existing_id[0]))
-                                        else:
-                                            c.execute("INSERT INTO clinical_records (patient_id, transcription, audio_file_path) VALUES (?, ?, ?)",
-                                                    (patient_id, transcription, audio_file_path))
-                                        
-                                        conn.commit()
-                                        st.success("Transcription saved to database!")
-                                        st.rerun()
-                                    except Exception as db_error:
-                                        st.error(f"Error saving transcription to database: {str(db_error)}")
-                                else:
-                                    st.error(f"Error: {response.status_code} - {response.text}")
-                            except Exception as e:
-                                st.error(f"Error transcribing audio: {str(e)}")
+                                f.write(audio_bytes)
+                        
+                        # Transcribe in the background; the transcript is saved to the database when done
+                        st.session_state.transcription_job_id = get_job_queue().submit(
+                            "transcription", patient_id,
+                            {"audio_file_path": audio_file_path, "language": "", "requester": requester_id()},
+                            st.session_state.openai_api_key
+                        )
+                        st.rerun()
+            
+            # Show the progress of this patient's latest transcription, and pick up its result when it finishes
+            if transcription_job and not job_progress(transcription_job, "Transcription"):
+                if transcription_job.id == st.session_state.get('transcription_job_id'):
+                    st.session_state.transcription_job_id = None
+                    if transcription_job.status == "done":
+                        st.session_state.conversation_text = transcription_job.result["transcription"]
+                        st.session_state.current_analysis = None
+                        if transcription_job.result.get("removed_seconds", 0) >= 1:
+                            st.info(f"Removed {transcription_job.result['removed_seconds']:.1f} seconds of silence before transcription.")
+                        st.success("Transcription saved to database!")
+                    elif transcription_job.status == "failed":
+                        st.error(f"Error transcribing audio: {transcription_job.error}")
         
         # After recording/uploading, check if we have conversation text to analyze
         if st.session_state.conversation_text:
@@ -3313,14 +4140,53 @@ def clinical_interaction_page():
                     st.session_state.show_manual_entry = False  # Hide the form
                     st.rerun()
             
-            # Generate AI analysis if not already done
+            # Generate AI analysis if not already done, in the background unless there is no valid API key
             if not st.session_state.current_analysis:
-                with st.spinner("Analyzing conversation..."):
+                api_key = st.session_state.openai_api_key.strip()
+                if not api_key.startswith("sk-") or len(api_key) < 20:
+                    # Simulated analysis or invalid key report, no API call involved
                     st.session_state.current_analysis = generate_ai_analysis(
                         st.session_state.conversation_text,
                         patient_id=patient_id,
                         patient_name=patient_name
                     )
+                    if st.session_state.current_analysis:
+                        st.rerun()
+                else:
+                    analysis_job = get_job_queue().latest("analysis", patient_id)
+                    if analysis_job is None or analysis_job.payload.get("transcription") != st.session_state.conversation_text:
+                        analysis_job = get_job_queue().get(get_job_queue().submit(
+                            "analysis", patient_id,
+                            {"transcription": st.session_state.conversation_text, "patient_name": patient_name,
+                             "requester": requester_id(), "structured": True},
+                            api_key
+                        ))
+                    
+                    if analysis_job.status == "done":
+                        st.session_state.current_analysis = analysis_job.result
+                        st.rerun()
+                    elif analysis_job.status == "failed":
+                        st.error(f"Error generating AI analysis: {analysis_job.error}")
+                        if st.button("Retry AI Analysis", key="retry_analysis_btn"):
+                            get_job_queue().submit(
+                                "analysis", patient_id,
+                                {"transcription": st.session_state.conversation_text, "patient_name": patient_name,
+                                 "requester": requester_id(), "structured": True},
+                                api_key
+                            )
+                            st.rerun()
+                    else:
+                        # Show the reports as far as they have been written
+                        st.subheader("AI Analysis")
+                        job_progress(analysis_job, "Analysis")
+                        partial = analysis_job.result or {}
+                        stream_gpt3_col, stream_gpt4_col = st.columns(2)
+                        with stream_gpt3_col:
+                            st.markdown("### GPT-3.5 Analysis")
+                            st.markdown(partial.get("gpt3", "") + " ▌")
+                        with stream_gpt4_col:
+                            st.markdown("### GPT-4 Analysis")
+                            st.markdown(partial.get("gpt4", "") + " ▌")
             
             if st.session_state.current_analysis:
                 # Create tabs for GPT-3.5 and GPT-4 analyses
@@ -3367,6 +4233,17 @@ def clinical_interaction_page():
                     st.markdown("### GPT-4 Analysis")
                     st.markdown(f'<div class="analysis-container">{st.session_state.current_analysis.get("gpt4", "No GPT-4 analysis available")}</div>', unsafe_allow_html=True)
                 
+                # Structured fields extracted with the reports, already saved to the clinical record
+                clinical_fields = st.session_state.current_analysis.get("fields")
+                if clinical_fields:
+                    with st.expander("Structured Clinical Data (saved to the clinical record)"):
+                        st.markdown(f"**Chief complaint:** {clinical_fields['chief_complaint'] or '—'}")
+                        st.markdown("**Symptoms:** " + ("; ".join(clinical_fields['symptoms']) or "—"))
+                        st.markdown("**Teeth involved (FDI):** " + (", ".join(str(tooth) for tooth in clinical_fields['teeth_involved']) or "—"))
+                        st.markdown(f"**Diagnosis:** {clinical_fields['diagnosis'] or '—'}")
+                        st.markdown(f"**Treatment plan:** {clinical_fields['treatment_plan'] or '—'}")
+                        st.markdown(f"**Follow-up:** {clinical_fields['follow_up'] or '—'}")
+                
                 # Save options
                 st.markdown("### Save Options")
                 
@@ -3379,20 +4256,8 @@ def clinical_interaction_page():
                     with save_col1:
                         if st.button("💾 Save GPT-3.5 Analysis", key="save_gpt3_btn", use_container_width=True):
                             try:
-                                # Check if a record already exists for this patient
-                                c.execute("SELECT id FROM clinical_records WHERE patient_id = ?", (patient_id,))
-                                existing_id = c.fetchone()
+                                save_clinical_record(patient_id, ai_analysis=st.session_state.current_analysis["gpt3"])
                                 
-                                if existing_id:
-                                    # Update existing record
-                                    c.execute("UPDATE clinical_records SET ai_analysis = ? WHERE id = ?", 
-                                            (st.session_state.current_analysis["gpt3"], existing_id[0]))
-                                else:
-                                    # This shouldn't happen as we should already have a record from transcription save
-                                    c.execute("INSERT INTO clinical_records (patient_id, ai_analysis) VALUES (?, ?)",
-                                            (patient_id, st.session_state.current_analysis["gpt3"]))
-                                
-                                conn.commit()
                                 st.success("GPT-3.5 analysis saved successfully!")
                             except Exception as e:
                                 st.error(f"Error saving analysis: {str(e)}")
@@ -3427,22 +4292,10 @@ def clinical_interaction_page():
                     with save_col1:
                         if st.button("💾 Save GPT-4 Analysis", key="save_gpt4_btn", use_container_width=True):
                             try:
-                                # Check if a record already exists for this patient
-                                c.execute("SELECT id FROM clinical_records WHERE patient_id = ?", (patient_id,))
-                                existing_id = c.fetchone()
-                                
-                                if existing_id:
-                                    # Update existing record with a note that it's GPT-4
-                                    analysis_with_note = st.session_state.current_analysis["gpt4"] + "\n\n*This analysis was generated by GPT-4.*"
-                                    c.execute("UPDATE clinical_records SET ai_analysis = ? WHERE id = ?", 
-                                            (analysis_with_note, existing_id[0]))
-                                else:
-                                    # This shouldn't happen as we should already have a record from transcription save
-                                    analysis_with_note = st.session_state.current_analysis["gpt4"] + "\n\n*This analysis was generated by GPT-4.*"
-                                    c.execute("INSERT INTO clinical_records (patient_id, ai_analysis) VALUES (?, ?)",
-                                            (patient_id, analysis_with_note))
+                                # Save with a note that it's GPT-4
+                                analysis_with_note = st.session_state.current_analysis["gpt4"] + "\n\n*This analysis was generated by GPT-4.*"
+                                save_clinical_record(patient_id, ai_analysis=analysis_with_note)
                                 
-                                conn.commit()
                                 st.success("GPT-4 analysis saved successfully!")
                             except Exception as e:
                                 st.error(f"Error saving analysis: {str(e)}")
@@ -3474,11 +4327,7 @@ def clinical_interaction_page():
         # Display previous clinical analyses
         st.markdown("---")
         st.markdown("### Previous Clinical Records")
-        c.execute("SELECT ai_analysis, record_date FROM clinical_records WHERE patient_id = ? AND ai_analysis IS NOT NULL", (patient_id,))
-        previous_analyses = c.fetchall()
-        
-        # Close connection
-        conn.close()
+        previous_analyses = db.query("SELECT ai_analysis, record_date FROM clinical_records WHERE patient_id = ? AND ai_analysis IS NOT NULL", (patient_id,))
         
         if previous_analyses:
             for i, (analysis, record_date) in enumerate(previous_analyses):
@@ -3512,6 +4361,9 @@ def clinical_interaction_page():
                             st.info("PDF export requires additional packages. Install pdfkit and markdown packages for PDF export functionality.")
         else:
             st.info("No previous clinical records available.")
+        
+        # Keep polling while this patient's transcription or analysis is in progress
+        poll_jobs(transcription_job, analysis_job)
 
 # Helper functions for clinical interaction
 def calculate_age(birth_date_str):
@@ -3522,12 +4374,35 @@ def calculate_age(birth_date_str):
     except:
         return "Unknown"
 
+def encode_json(data):
+    """Serialize form data to the canonical JSON stored in responses/findings columns."""
+    return json.dumps(data, sort_keys=True, separators=(',', ':'), default=str)
+
+def decode_json(data_str):
+    """
+    Parse a stored responses/findings value.
+    
+    Rows written since the JSON migration decode with a single json.loads;
+    only rows the backfill has not reached yet fall back to safe_eval.
+    """
+    if not data_str:
+        return {}
+    try:
+        return json.loads(data_str)
+    except ValueError:
+        return safe_eval(data_str)
+
 def safe_eval(data_str):
     """Safely parse a string representation of a dictionary."""
     try:
         # First try using ast.literal_eval which is safer than eval
         import ast
         return ast.literal_eval(data_str)
+    except:
+        pass
+    try:
+        # Legacy saves doubled every quote (str(dict).replace("'", "''")); undo that first
+        return ast.literal_eval(data_str.replace("''", "'"))
     except:
         try:
             # If that fails, try using json.loads with some preprocessing
@@ -3612,38 +4487,802 @@ def export_report_as_pdf(report_text, patient_name):
         </html>
         """
         
-        # Generate PDF using pdfkit
-        pdf_options = {
-            'page-size': 'Letter',
-            'margin-top': '0.75in',
-            'margin-right': '0.75in',
-            'margin-bottom': '0.75in',
-            'margin-left': '0.75in',
-            'encoding': 'UTF-8',
-        }
+        # Generate PDF using pdfkit
+        pdf_options = {
+            'page-size': 'Letter',
+            'margin-top': '0.75in',
+            'margin-right': '0.75in',
+            'margin-bottom': '0.75in',
+            'margin-left': '0.75in',
+            'encoding': 'UTF-8',
+        }
+        
+        pdf_data = pdfkit.from_string(styled_html, False, options=pdf_options)
+        
+        # Create download link
+        b64_pdf = base64.b64encode(pdf_data).decode()
+        pdf_link = f'<a href="data:application/pdf;base64,{b64_pdf}" download="Clinical_Report_{patient_name.replace(" ", "_")}_{datetime.now().strftime("%Y%m%d")}.pdf">Download PDF Report</a>'
+        
+        return pdf_link
+    
+    except Exception as e:
+        st.error(f"Error creating PDF: {str(e)}")
+        
+        # Fallback to plain text download if PDF generation fails
+        return create_download_link(
+            report_text, 
+            f"Clinical_Report_{patient_name.replace(' ', '_')}_{datetime.now().strftime('%Y%m%d')}.md",
+            "Download as Markdown"
+        )
+
+# Models each clinical analysis is generated with, as (result key, model, label)
+ANALYSIS_MODELS = [
+    ("gpt3", "gpt-3.5-turbo", "GPT-3.5"),
+    ("gpt4", "gpt-4-turbo-preview", "GPT-4"),
+]
+ANALYSIS_SYSTEM_PROMPT = "You are DentAI, an expert dental assistant AI that creates clinical reports from dentist-patient conversations."
+
+# Shared OpenAI client layer
+# Retries per request on connection errors, 408/409/429 and 5xx, with exponential backoff
+OPENAI_MAX_RETRIES = 4
+OPENAI_TIMEOUT_SECONDS = 120
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling an upstream that the circuit breaker has marked as down."""
+
+class CircuitBreaker:
+    """
+    Fail fast while an upstream service is down.
+    
+    After failure_threshold consecutive failed calls the circuit opens and
+    calls raise CircuitOpenError immediately, instead of each session
+    waiting through its own timeouts and retries. After reset_timeout
+    seconds one trial call is let through; its success closes the circuit
+    and its failure keeps it open for another reset_timeout.
+    """
+    
+    def __init__(self, name, failure_threshold=3, reset_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+    
+    @property
+    def is_open(self):
+        with self._lock:
+            return self._opened_at is not None
+    
+    def _before_call(self):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            wait_seconds = self._opened_at + self.reset_timeout - time.time()
+            if wait_seconds > 0 or self._trial_running:
+                raise CircuitOpenError(
+                    f"{self.name} is unavailable after repeated failures; retrying in {max(wait_seconds, 1):.0f}s"
+                )
+            self._trial_running = True
+    
+    def _after_call(self, failed):
+        with self._lock:
+            self._trial_running = False
+            if not failed:
+                self._failures = 0
+                self._opened_at = None
+                return
+            self._failures += 1
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.time()
+    
+    def call(self, fn, *args, **kwargs):
+        """Call fn through the breaker. Only upstream outages count as failures."""
+        self._before_call()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            self._after_call(is_upstream_failure(e))
+            raise
+        self._after_call(False)
+        return result
+
+def is_upstream_failure(error):
+    """True for errors meaning the API is unreachable or failing, not for bad requests or keys."""
+    if isinstance(error, APIConnectionError):
+        return True
+    return isinstance(error, APIStatusError) and error.status_code >= 500
+
+@st.cache_resource
+def get_openai_breaker():
+    """Return the circuit breaker for the OpenAI API shared by all sessions in this process."""
+    return CircuitBreaker("OpenAI API")
+
+# Account limits as (requests per minute, tokens per minute) per model; None
+# means the model has no token limit. Set these to your OpenAI account tier.
+OPENAI_RATE_LIMITS = {
+    "gpt-3.5-turbo": (3500, 160000),
+    "gpt-4-turbo-preview": (500, 30000),
+    "whisper-1": (50, None),
+}
+# Completion tokens reserved per analysis request, matching its max_tokens
+ANALYSIS_MAX_TOKENS = 1500
+
+def estimate_tokens(text):
+    """Rough token count for rate limiting: about four characters per token."""
+    return len(text) // 4 + 1
+
+class TokenBucket:
+    """Capacity refilled continuously at per_minute units per minute."""
+    
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.level = per_minute
+        self.updated_at = time.monotonic()
+    
+    def delay(self, amount):
+        """Seconds until amount is available (0 if it is available now)."""
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        return max(0.0, (min(amount, self.capacity) - self.level) / self.rate)
+    
+    def take(self, amount):
+        self.level -= min(amount, self.capacity)
+
+class RateLimiter:
+    """
+    Process-wide requests-per-minute and tokens-per-minute limits per model,
+    shared by every session and background job.
+    
+    Callers over the limit queue instead of sending requests that would come
+    back as 429s. Waiting requests are granted round-robin across requesters
+    (sessions or jobs), so one session with many queued chunks cannot starve
+    the others: each requester's requests are first-in first-out, and after
+    one is granted that requester moves to the back of the line.
+    """
+    
+    def __init__(self, limits):
+        self._buckets = {
+            model: (TokenBucket(rpm), TokenBucket(tpm) if tpm else None)
+            for model, (rpm, tpm) in limits.items()
+        }
+        self._waiting = {}  # model -> OrderedDict of requester -> deque of tickets
+        self._cond = threading.Condition()
+    
+    def acquire(self, model, tokens=0, requester=None):
+        """Block until a request of tokens tokens to model is within its limits."""
+        if model not in self._buckets:
+            return
+        requests_bucket, tokens_bucket = self._buckets[model]
+        ticket = object()
+        
+        with self._cond:
+            waiting = self._waiting.setdefault(model, OrderedDict())
+            waiting.setdefault(requester, deque()).append(ticket)
+            while True:
+                head = next(iter(waiting))
+                if waiting[head][0] is not ticket:
+                    self._cond.wait()
+                    continue
+                
+                delay = max(requests_bucket.delay(1), tokens_bucket.delay(tokens) if tokens_bucket else 0.0)
+                if delay > 0:
+                    self._cond.wait(timeout=delay)
+                    continue
+                
+                requests_bucket.take(1)
+                if tokens_bucket:
+                    tokens_bucket.take(tokens)
+                waiting[head].popleft()
+                if waiting[head]:
+                    waiting.move_to_end(head)
+                else:
+                    del waiting[head]
+                self._cond.notify_all()
+                return
+
+@st.cache_resource
+def get_rate_limiter():
+    """Return the OpenAI rate limiter shared by all sessions in this process."""
+    return RateLimiter(OPENAI_RATE_LIMITS)
+
+def call_openai(create, model, tokens=0, requester=None, **kwargs):
+    """
+    Make one OpenAI API call: wait for model's rate limits on behalf of
+    requester, then call create(model=model, **kwargs) through the circuit
+    breaker.
+    """
+    get_rate_limiter().acquire(model, tokens, requester)
+    return get_openai_breaker().call(create, model=model, **kwargs)
+
+def requester_id():
+    """Identifies this browser session to the rate limiter's fair scheduling."""
+    if 'requester_id' not in st.session_state:
+        st.session_state.requester_id = uuid.uuid4().hex
+    return st.session_state.requester_id
+
+@st.cache_resource(max_entries=32)
+def get_openai_client(api_key):
+    """
+    Return the OpenAI client for api_key, created once per process.
+    
+    Each client keeps its own pool of keep-alive HTTPS connections, so
+    reusing it skips connection and TLS setup on every call. The SDK retries
+    connection errors, 429 and 5xx responses with exponential backoff and
+    honours Retry-After.
+    """
+    return OpenAI(api_key=api_key, max_retries=OPENAI_MAX_RETRIES, timeout=OPENAI_TIMEOUT_SECONDS)
+
+@st.cache_resource
+def get_ai_executor():
+    """Thread pool shared by all sessions for OpenAI calls; bounds concurrent requests per process."""
+    return ThreadPoolExecutor(max_workers=8, thread_name_prefix="dentai-ai")
+
+class ApiHealthProbe:
+    """
+    Cached OpenAI reachability and key check, shared by all sessions.
+
+    A key is probed with models.list(), which costs no tokens. Results are
+    cached per key: successes for ttl seconds and failures for failure_ttl,
+    so a fixed key or restored quota is noticed quickly. Once a cached result
+    is stale it is still returned while a background thread re-probes, so
+    only the first check of a key ever waits on the network.
+    """
+    
+    def __init__(self, ttl=300, failure_ttl=30):
+        self.ttl = ttl
+        self.failure_ttl = failure_ttl
+        self._results = {}  # key digest -> (ok, error message, checked at)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _digest(api_key):
+        return hashlib.sha256(api_key.encode()).hexdigest()
+    
+    def _probe(self, api_key):
+        try:
+            get_openai_breaker().call(get_openai_client(api_key).models.list)
+            result = (True, None, time.time())
+        except Exception as e:
+            result = (False, str(e), time.time())
+        with self._lock:
+            self._results[self._digest(api_key)] = result
+        return result
+    
+    def _refresh(self, api_key, digest):
+        try:
+            self._probe(api_key)
+        finally:
+            with self._lock:
+                self._refreshing.discard(digest)
+    
+    def refresh_async(self, api_key):
+        """Re-probe api_key in a background thread unless that is already happening."""
+        digest = self._digest(api_key)
+        with self._lock:
+            if digest in self._refreshing:
+                return
+            self._refreshing.add(digest)
+        threading.Thread(target=self._refresh, args=(api_key, digest), name="dentai-api-probe", daemon=True).start()
+    
+    def check(self, api_key):
+        """
+        Return (ok, error message) for api_key, probing synchronously only
+        when the key has never been checked.
+        """
+        with self._lock:
+            cached = self._results.get(self._digest(api_key))
+        if cached is None:
+            cached = self._probe(api_key)
+        else:
+            ok, error_message, checked_at = cached
+            if time.time() - checked_at > (self.ttl if ok else self.failure_ttl):
+                self.refresh_async(api_key)
+        return cached[0], cached[1]
+
+@st.cache_resource
+def get_api_health_probe():
+    """Return the API health probe shared by all sessions in this process."""
+    return ApiHealthProbe()
+
+# Bump when the analysis prompt or system prompt changes meaning, so cached
+# analyses made with the old template are no longer served
+PROMPT_TEMPLATE_VERSION = 1
+LLM_CACHE_MAX_BYTES = 50 * 1024 * 1024
+
+class CacheUsage:
+    """
+    Process-wide buffer of cache hits, misses and entry touches.
+    
+    Cache lookups are plain SELECTs; the bookkeeping they used to write
+    (cache_stats counters, each entry's hits and last_used_at) is collected
+    here and written in one transaction at most every flush_seconds or
+    flush_lookups lookups, from a background thread, so a lookup never waits
+    on the write lock. Counts that fail to flush are kept for the next try.
+    """
+    
+    # Cache name -> statement bumping one entry's hits and last_used_at, keyed by its primary key
+    TOUCH_SQL = {
+        "llm": "UPDATE llm_cache SET hits = hits + ?, last_used_at = MAX(last_used_at, ?) WHERE cache_key = ?",
+        "transcription": "UPDATE transcription_cache SET hits = hits + ?, last_used_at = MAX(last_used_at, ?) "
+                         "WHERE audio_sha256 = ? AND model = ? AND language = ?",
+    }
+    
+    def __init__(self, pool, flush_seconds=10, flush_lookups=100):
+        self.pool = pool
+        self.flush_seconds = flush_seconds
+        self.flush_lookups = flush_lookups
+        self._lock = threading.Lock()
+        self._counts = {}    # name -> [hits, misses]
+        self._touches = {}   # (name, key) -> [hits, last used at]
+        self._pending = 0
+        self._last_flush = time.monotonic()
+        self._flushing = False
+    
+    def record(self, name, hit, key=()):
+        """Count a lookup of the named cache; on a hit, key is the entry's primary key tuple."""
+        now = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+        with self._lock:
+            counts = self._counts.setdefault(name, [0, 0])
+            counts[0 if hit else 1] += 1
+            if hit:
+                touch = self._touches.setdefault((name, key), [0, now])
+                touch[0] += 1
+                touch[1] = now
+            self._pending += 1
+            due = (self._pending >= self.flush_lookups
+                   or time.monotonic() - self._last_flush >= self.flush_seconds)
+            if not due or self._flushing:
+                return
+            self._flushing = True
+        threading.Thread(target=self._flush_in_background, name="dentai-cache-usage", daemon=True).start()
+    
+    def pending(self, name):
+        """(hits, misses) of the named cache not yet written to cache_stats."""
+        with self._lock:
+            return tuple(self._counts.get(name, (0, 0)))
+    
+    def _flush_in_background(self):
+        try:
+            self.flush()
+        except sqlite3.OperationalError as e:
+            print(f"Cache usage flush deferred: {e}")
+        finally:
+            with self._lock:
+                self._flushing = False
+    
+    def flush(self):
+        """Write the buffered counts and touches in one transaction."""
+        with self._lock:
+            counts, self._counts = self._counts, {}
+            touches, self._touches = self._touches, {}
+            self._pending = 0
+            self._last_flush = time.monotonic()
+        if not counts:
+            return
+        
+        try:
+            with self.pool.transaction() as conn:
+                conn.executemany(
+                    "INSERT INTO cache_stats (name, hits, misses) VALUES (?, ?, ?) "
+                    "ON CONFLICT(name) DO UPDATE SET hits = hits + excluded.hits, misses = misses + excluded.misses",
+                    [(name, hits, misses) for name, (hits, misses) in counts.items()]
+                )
+                for (name, key), (hits, used_at) in touches.items():
+                    conn.execute(self.TOUCH_SQL[name], (hits, used_at) + key)
+        except BaseException:
+            self._restore(counts, touches)
+            raise
+    
+    def _restore(self, counts, touches):
+        with self._lock:
+            for name, (hits, misses) in counts.items():
+                merged = self._counts.setdefault(name, [0, 0])
+                merged[0] += hits
+                merged[1] += misses
+            for entry, (hits, used_at) in touches.items():
+                merged = self._touches.setdefault(entry, [0, used_at])
+                merged[0] += hits
+                merged[1] = max(merged[1], used_at)
+
+@st.cache_resource
+def get_cache_usage():
+    """Return the cache usage buffer shared by all sessions, flushed once more at exit."""
+    usage = CacheUsage(get_db_pool())
+    atexit.register(usage.flush)
+    return usage
+
+def llm_cache_key(model, prompt, system_prompt=ANALYSIS_SYSTEM_PROMPT):
+    """Content hash identifying one analysis: template version, model, system prompt and full prompt."""
+    payload = json.dumps([PROMPT_TEMPLATE_VERSION, model, system_prompt, prompt])
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def llm_cache_get(cache_key):
+    """Return the cached response for cache_key, or None; the hit is recorded by get_cache_usage()."""
+    row = get_db_pool().query_one("SELECT response FROM llm_cache WHERE cache_key = ?", (cache_key,))
+    get_cache_usage().record("llm", row is not None, (cache_key,))
+    return row[0] if row else None
+
+def llm_cache_put(cache_key, model, response, max_bytes=LLM_CACHE_MAX_BYTES):
+    """Store a response and, once the cache is over max_bytes, evict least recently used entries."""
+    size = len(response.encode())
+    pool = get_db_pool()
+    with pool.transaction() as conn:
+        conn.execute(
+            "INSERT INTO llm_cache (cache_key, model, response, size_bytes) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(cache_key) DO UPDATE SET model = excluded.model, response = excluded.response, "
+            "size_bytes = excluded.size_bytes, last_used_at = excluded.last_used_at",
+            (cache_key, model, response, size)
+        )
+        total = conn.execute("SELECT bytes FROM cache_stats WHERE name = 'llm'").fetchone()
+    if not total or total[0] <= max_bytes:
+        return
+    
+    # Eviction orders by last_used_at, so write pending touches first
+    get_cache_usage().flush()
+    with pool.transaction() as conn:
+        excess = conn.execute("SELECT bytes FROM cache_stats WHERE name = 'llm'").fetchone()[0] - max_bytes
+        evicted = []
+        for key, entry_size in conn.execute("SELECT cache_key, size_bytes FROM llm_cache ORDER BY last_used_at"):
+            if excess <= 0:
+                break
+            evicted.append((key,))
+            excess -= entry_size
+        conn.executemany("DELETE FROM llm_cache WHERE cache_key = ?", evicted)
+
+def cache_lookup_counts(name):
+    """(hits, misses) recorded for the named cache, including lookups not flushed yet."""
+    stored = get_db_pool().query_one("SELECT hits, misses FROM cache_stats WHERE name = ?", (name,)) or (0, 0)
+    pending = get_cache_usage().pending(name)
+    return stored[0] + pending[0], stored[1] + pending[1]
+
+def llm_cache_summary():
+    """Entries, bytes, hits and misses of the LLM cache."""
+    db = get_db_pool()
+    entries = db.query_one("SELECT COUNT(*) FROM llm_cache")[0]
+    size = (db.query_one("SELECT bytes FROM cache_stats WHERE name = 'llm'") or (0,))[0]
+    hits, misses = cache_lookup_counts("llm")
+    return {"entries": entries, "bytes": size, "hits": hits, "misses": misses}
+
+def request_analysis(client, model, prompt, on_delta=None, requester=None, system_prompt=ANALYSIS_SYSTEM_PROMPT,
+                     max_tokens=ANALYSIS_MAX_TOKENS):
+    """
+    Run one chat completion for a clinical analysis prompt and return its text.
+    
+    With on_delta the completion is streamed and on_delta(text) is called with
+    each fragment as it arrives; the full text is still returned at the end.
+    The request waits its turn in the rate limiter on behalf of requester.
+    """
+    response = call_openai(
+        client.chat.completions.create,
+        model,
+        tokens=estimate_tokens(system_prompt + prompt) + max_tokens,
+        requester=requester,
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ],
+        max_tokens=max_tokens,
+        temperature=0.2,
+        stream=on_delta is not None
+    )
+    if on_delta is None:
+        return response.choices[0].message.content
+    
+    parts = []
+    for chunk in response:
+        text = chunk.choices[0].delta.content if chunk.choices else None
+        if text:
+            parts.append(text)
+            on_delta(text)
+    return "".join(parts)
+
+def build_analysis_prompt(transcription, patient_id, patient_name, source_label="CONVERSATION TRANSCRIPT"):
+    """Clinical report prompt for a conversation transcript (or notes condensed from one)."""
+    return f"""
+        You are DentAI, an expert dental assistant AI. Analyze the following conversation between a dentist and patient.
+        
+        PATIENT ID: {patient_id}
+        PATIENT NAME: {patient_name}
+        
+        {source_label}:
+        {transcription}
+        
+        Provide a comprehensive clinical report including:
+        1. Summary of the interaction
+        2. Patient's chief complaint and symptoms
+        3. Clinical observations made by the dentist
+        4. Preliminary diagnosis (if mentioned)
+        5. Treatment plan discussed
+        6. Any follow-up recommendations
+        
+        Format the report in Markdown with appropriate headings, bullet points, and emphasis.
+        Be specific, professional, and focus only on information actually present in the conversation.
+        If the conversation does not contain certain information, do not invent details.
+        
+        CLINICAL REPORT:
+        """
+
+def analysis_error_report(label, error):
+    """Markdown shown in place of an analysis that failed."""
+    return f"""
+            # Error with {label} Analysis
+            
+            There was an error generating the analysis with {label}:
+            
+            ```
+            {str(error)}
+            ```
+            
+            *This error occurred while trying to process your conversation.*
+            """
+
+# Long transcript condensing
+# Transcripts longer than this are condensed segment by segment before analysis
+LONG_TRANSCRIPT_TOKENS = 6000
+SEGMENT_TOKENS = 2500
+SEGMENT_OVERLAP_TOKENS = 200
+SEGMENT_SUMMARY_MODEL = "gpt-3.5-turbo"
+SEGMENT_SUMMARY_MAX_TOKENS = 600
+SEGMENT_SYSTEM_PROMPT = "You are DentAI, an expert dental assistant AI that extracts clinical facts from parts of long dentist-patient conversations."
+CONDENSED_SOURCE_LABEL = "CONVERSATION NOTES (condensed, in order, from a long conversation)"
+
+@st.cache_resource
+def get_token_encoding():
+    """The tiktoken encoding of the analysis models, or None to estimate token counts instead."""
+    if not TIKTOKEN_AVAILABLE:
+        return None
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        # The encoding is downloaded on first use and may be unreachable
+        return None
+
+def count_tokens(text):
+    """Token count of text, exact with tiktoken and estimated without it."""
+    encoding = get_token_encoding()
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+def split_transcript(text, max_tokens=SEGMENT_TOKENS, overlap_tokens=SEGMENT_OVERLAP_TOKENS):
+    """
+    Split a transcript into consecutive segments of at most max_tokens.
+    
+    Segments break between sentences or speaker turns, and each one repeats
+    up to overlap_tokens from the end of the previous segment so that
+    nothing said across a boundary loses its context.
+    """
+    units = []
+    for sentence in re.split(r'(?<=[.!?])\s+|\n+', text):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        tokens = count_tokens(sentence)
+        if tokens <= max_tokens:
+            units.append((sentence, tokens))
+            continue
+        # A run-on "sentence" longer than a segment is cut between words
+        words = sentence.split()
+        step = max(1, len(words) * max_tokens // tokens)
+        for start in range(0, len(words), step):
+            piece = " ".join(words[start:start + step])
+            units.append((piece, count_tokens(piece)))
+    
+    segments = []
+    current, current_tokens = [], 0
+    for unit, tokens in units:
+        if current and current_tokens + tokens > max_tokens:
+            segments.append(" ".join(text for text, _ in current))
+            # Carry the tail of this segment over into the next one
+            overlap, overlap_total = [], 0
+            for previous in reversed(current):
+                if overlap_total + previous[1] > overlap_tokens:
+                    break
+                overlap.insert(0, previous)
+                overlap_total += previous[1]
+            current, current_tokens = overlap, overlap_total
+        current.append((unit, tokens))
+        current_tokens += tokens
+    if current:
+        segments.append(" ".join(text for text, _ in current))
+    return segments
+
+def build_segment_prompt(segment, index, total):
+    """Prompt extracting the clinical facts from one segment of a long conversation."""
+    return f"""
+        This is part {index} of {total} of a long conversation between a dentist and a patient.
+        Consecutive parts overlap slightly.
+        
+        CONVERSATION PART:
+        {segment}
+        
+        List every clinically relevant fact in this part, concisely and in the order it comes up:
+        symptoms and complaints with their duration, medical and dental history, findings and
+        observations (with tooth numbers), diagnoses, treatments discussed or agreed, and follow-up.
+        Say who said what where it matters. Do not invent details and do not add commentary.
+        """
+
+def summarize_segments(client, segments, requester=None, on_progress=None):
+    """
+    Summarize segments in parallel on the AI thread pool and return the
+    summaries in order. Summaries are cached like analyses, so re-analyzing
+    a transcript only sends the segments that changed.
+    """
+    summaries = [None] * len(segments)
+    futures = {}
+    for i, segment in enumerate(segments):
+        prompt = build_segment_prompt(segment, i + 1, len(segments))
+        cache_key = llm_cache_key(SEGMENT_SUMMARY_MODEL, prompt, SEGMENT_SYSTEM_PROMPT)
+        summaries[i] = llm_cache_get(cache_key)
+        if summaries[i] is None:
+            future = get_ai_executor().submit(
+                request_analysis, client, SEGMENT_SUMMARY_MODEL, prompt, requester=requester,
+                system_prompt=SEGMENT_SYSTEM_PROMPT, max_tokens=SEGMENT_SUMMARY_MAX_TOKENS
+            )
+            futures[future] = (i, cache_key)
+    
+    done = len(segments) - len(futures)
+    for future in as_completed(futures):
+        i, cache_key = futures[future]
+        summaries[i] = future.result()
+        llm_cache_put(cache_key, SEGMENT_SUMMARY_MODEL, summaries[i])
+        done += 1
+        if on_progress:
+            on_progress(done, len(segments))
+    return summaries
+
+def condense_transcript(client, transcription, requester=None, on_progress=None):
+    """
+    The conversation text an analysis is written from, for a transcript of
+    any length.
+    
+    A transcript that fits in LONG_TRANSCRIPT_TOKENS is used as it is. A
+    longer one is split into overlapping segments that are summarized in
+    parallel (map), and the reports are written from the summaries in order
+    (reduce), so the analysis takes about as long as one segment plus one
+    report whatever the length of the visit. Notes that are themselves still
+    too long are condensed again.
+    
+    Args:
+        on_progress: Optional callback(segments done, total segments)
+    
+    Returns:
+        (text, label for the text in prompts)
+    """
+    text = transcription
+    while count_tokens(text) > LONG_TRANSCRIPT_TOKENS:
+        segments = split_transcript(text)
+        if len(segments) < 2:
+            break
+        summaries = summarize_segments(client, segments, requester, on_progress)
+        text = "\n\n".join(f"Part {i} of {len(summaries)}:\n{summary.strip()}" for i, summary in enumerate(summaries, 1))
+    
+    if text is transcription:
+        return transcription, "CONVERSATION TRANSCRIPT"
+    return text, CONDENSED_SOURCE_LABEL
+
+# Structured clinical extraction
+CLINICAL_EXTRACTION_MODEL = "gpt-3.5-turbo"
+CLINICAL_EXTRACTION_MAX_TOKENS = 800
+CLINICAL_EXTRACTION_SYSTEM_PROMPT = "You are DentAI, an expert dental assistant AI that extracts structured clinical data from dentist-patient conversations. Reply with JSON only."
+
+@dataclass
+class ClinicalFields:
+    """Typed clinical facts extracted from a conversation, one column each in clinical_records."""
+    chief_complaint: str = ""
+    symptoms: list = field(default_factory=list)
+    teeth_involved: list = field(default_factory=list)  # FDI tooth numbers
+    diagnosis: str = ""
+    treatment_plan: str = ""
+    follow_up: str = ""
+    
+    @classmethod
+    def from_json(cls, text):
+        """
+        Parse and type-check a model's JSON reply. Missing or mistyped fields
+        are left empty, teeth given as a string such as "36, 46" are split on
+        non-digits, and tooth numbers that are not valid FDI notation are
+        dropped. Raises ValueError if the reply is not a JSON object.
+        """
+        data = json.loads(text)
+        if not isinstance(data, dict):
+            raise ValueError("Clinical extraction did not return a JSON object")
+        
+        def text_field(name):
+            value = data.get(name)
+            return value.strip() if isinstance(value, str) else ""
         
-        pdf_data = pdfkit.from_string(styled_html, False, options=pdf_options)
+        symptoms = data.get("symptoms")
+        # Models sometimes answer "36, 46" or a single number instead of a list
+        listed = data.get("teeth_involved")
+        if isinstance(listed, str):
+            listed = re.findall(r"\d+", listed)
+        elif isinstance(listed, (int, float)):
+            listed = [int(listed)]
+        elif not isinstance(listed, list):
+            listed = []
+        teeth = []
+        for tooth in listed:
+            digits = re.sub(r"\D", "", str(tooth))
+            if is_fdi_tooth(digits) and int(digits) not in teeth:
+                teeth.append(int(digits))
+        return cls(
+            chief_complaint=text_field("chief_complaint"),
+            symptoms=[str(item).strip() for item in symptoms if str(item).strip()] if isinstance(symptoms, list) else [],
+            teeth_involved=sorted(teeth),
+            diagnosis=text_field("diagnosis"),
+            treatment_plan=text_field("treatment_plan"),
+            follow_up=text_field("follow_up"),
+        )
+
+def is_fdi_tooth(digits):
+    """True for a two-digit FDI tooth number: quadrants 1-4 teeth 1-8, or primary quadrants 5-8 teeth 1-5."""
+    if len(digits) != 2:
+        return False
+    quadrant, tooth = int(digits[0]), int(digits[1])
+    return (1 <= quadrant <= 4 and 1 <= tooth <= 8) or (5 <= quadrant <= 8 and 1 <= tooth <= 5)
+
+def build_extraction_prompt(text, source_label="CONVERSATION TRANSCRIPT"):
+    """Prompt asking for the ClinicalFields of a conversation as a JSON object."""
+    return f"""
+        Extract the clinical facts from the following conversation between a dentist and patient.
         
-        # Create download link
-        b64_pdf = base64.b64encode(pdf_data).decode()
-        pdf_link = f'<a href="data:application/pdf;base64,{b64_pdf}" download="Clinical_Report_{patient_name.replace(" ", "_")}_{datetime.now().strftime("%Y%m%d")}.pdf">Download PDF Report</a>'
+        {source_label}:
+        {text}
         
-        return pdf_link
-    
-    except Exception as e:
-        st.error(f"Error creating PDF: {str(e)}")
+        Reply with a JSON object with exactly these keys:
+        - "chief_complaint": the patient's main complaint, in one sentence
+        - "symptoms": list of symptoms, each a short phrase including duration or triggers if mentioned
+        - "teeth_involved": list of two-digit FDI tooth numbers (e.g. 36 for the lower left first molar)
+        - "diagnosis": the diagnosis or preliminary diagnosis stated by the dentist
+        - "treatment_plan": the treatment discussed or agreed
+        - "follow_up": follow-up appointments or instructions
         
-        # Fallback to plain text download if PDF generation fails
-        return create_download_link(
-            report_text, 
-            f"Clinical_Report_{patient_name.replace(' ', '_')}_{datetime.now().strftime('%Y%m%d')}.md",
-            "Download as Markdown"
-        )
+        Use "" or [] for anything the conversation does not mention. Do not invent details.
+        """
+
+def request_clinical_fields(client, text, source_label="CONVERSATION TRANSCRIPT", requester=None):
+    """
+    Extract ClinicalFields from conversation text with a JSON-mode completion.
+    The raw reply is cached like analyses.
+    """
+    prompt = build_extraction_prompt(text, source_label)
+    cache_key = llm_cache_key(CLINICAL_EXTRACTION_MODEL, prompt, CLINICAL_EXTRACTION_SYSTEM_PROMPT)
+    reply = llm_cache_get(cache_key)
+    if reply is not None:
+        return ClinicalFields.from_json(reply)
+    
+    response = call_openai(
+        client.chat.completions.create,
+        CLINICAL_EXTRACTION_MODEL,
+        tokens=estimate_tokens(CLINICAL_EXTRACTION_SYSTEM_PROMPT + prompt) + CLINICAL_EXTRACTION_MAX_TOKENS,
+        requester=requester,
+        messages=[
+            {"role": "system", "content": CLINICAL_EXTRACTION_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ],
+        max_tokens=CLINICAL_EXTRACTION_MAX_TOKENS,
+        temperature=0,
+        response_format={"type": "json_object"}
+    )
+    reply = response.choices[0].message.content
+    # Only replies that parse are cached
+    fields = ClinicalFields.from_json(reply)
+    llm_cache_put(cache_key, CLINICAL_EXTRACTION_MODEL, reply)
+    return fields
 
 def generate_ai_analysis(transcription, patient_id="Unknown", patient_name="Unknown Patient"):
     """
     Generate AI analysis using OpenAI API
     
+    Without a valid API key this returns a simulated or error report; with
+    one it runs analyze_transcription() and shows any errors in the page.
+    
     Args:
         transcription: The text transcription of the clinical interaction
         patient_id: ID of the patient (optional)
@@ -3729,47 +5368,17 @@ def generate_ai_analysis(transcription, patient_id="Unknown", patient_name="Unkn
         st.info("Connecting to OpenAI API for analysis... (this may take a moment)")
         
         # Initialize OpenAI client
-        client = OpenAI(api_key=api_key)
-        
-        # Create prompt for GPT
-        prompt = f"""
-        You are DentAI, an expert dental assistant AI. Analyze the following conversation between a dentist and patient.
-        
-        PATIENT ID: {patient_id}
-        PATIENT NAME: {patient_name}
-        
-        CONVERSATION TRANSCRIPT:
-        {transcription}
-        
-        Provide a comprehensive clinical report including:
-        1. Summary of the interaction
-        2. Patient's chief complaint and symptoms
-        3. Clinical observations made by the dentist
-        4. Preliminary diagnosis (if mentioned)
-        5. Treatment plan discussed
-        6. Any follow-up recommendations
-        
-        Format the report in Markdown with appropriate headings, bullet points, and emphasis.
-        Be specific, professional, and focus only on information actually present in the conversation.
-        If the conversation does not contain certain information, do not invent details.
+        client = get_openai_client(api_key)
         
-        CLINICAL REPORT:
-        """
-        
-        # Call the OpenAI API - first test connection with a basic request
+        # Long conversations are condensed segment by segment first
+        if count_tokens(transcription) > LONG_TRANSCRIPT_TOKENS:
+            st.info("This is a long conversation. Summarizing it in parts before the full analysis...")
         try:
-            # Test connection first with a small request
-            test_response = client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "user", "content": "Test connection. Respond with 'Connected'."}
-                ],
-                max_tokens=10
-            )
-            # If we get here, connection works
-        except Exception as test_error:
+            with st.spinner("Generating analysis with GPT-3.5 and GPT-4..."):
+                outcome = analyze_transcription(client, transcription, patient_id, patient_name, requester=requester_id())
+        except ApiUnreachableError as connection_error:
+            error_message = connection_error.reason
             # Connection error
-            error_message = str(test_error)
             if "authentication" in error_message.lower():
                 st.error("Authentication error: Your API key appears to be invalid")
                 error_type = "Authentication Error"
@@ -3806,64 +5415,10 @@ def generate_ai_analysis(transcription, patient_id="Unknown", patient_name="Unkn
             """
             return {"gpt3": error_analysis, "gpt4": error_analysis}
         
-        # Initialize results dictionary
-        results = {"gpt3": None, "gpt4": None}
-        
-        # First, get GPT-3.5 analysis
-        try:
-            st.info("Generating analysis with GPT-3.5 Turbo...")
-            gpt3_response = client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "You are DentAI, an expert dental assistant AI that creates clinical reports from dentist-patient conversations."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=1500,
-                temperature=0.2
-            )
-            results["gpt3"] = gpt3_response.choices[0].message.content
-        except Exception as gpt3_error:
-            st.error(f"Error with GPT-3.5 model: {str(gpt3_error)}")
-            results["gpt3"] = f"""
-            # Error with GPT-3.5 Analysis
-            
-            There was an error generating the analysis with GPT-3.5:
-            
-            ```
-            {str(gpt3_error)}
-            ```
-            
-            *This error occurred while trying to process your conversation.*
-            """
-        
-        # Now, get GPT-4 analysis
-        try:
-            st.info("Generating analysis with GPT-4...")
-            gpt4_response = client.chat.completions.create(
-                model="gpt-4-turbo-preview",
-                messages=[
-                    {"role": "system", "content": "You are DentAI, an expert dental assistant AI that creates clinical reports from dentist-patient conversations."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=1500,
-                temperature=0.2
-            )
-            results["gpt4"] = gpt4_response.choices[0].message.content
-        except Exception as gpt4_error:
-            st.error(f"Error with GPT-4 model: {str(gpt4_error)}")
-            results["gpt4"] = f"""
-            # Error with GPT-4 Analysis
-            
-            There was an error generating the analysis with GPT-4:
-            
-            ```
-            {str(gpt4_error)}
-            ```
-            
-            *This error occurred while trying to process your conversation.*
-            """
-            
-        return results
+        labels = {key: label for key, model, label in ANALYSIS_MODELS}
+        for key, model_error in outcome.failures.items():
+            st.error(f"Error with {labels[key]} model: {model_error}")
+        return outcome.reports
         
     except Exception as e:
         st.error(f"Error generating AI analysis: {str(e)}")
@@ -3888,6 +5443,98 @@ def generate_ai_analysis(transcription, patient_id="Unknown", patient_name="Unkn
         """
         return {"gpt3": error_analysis, "gpt4": error_analysis}
 
+class ApiUnreachableError(RuntimeError):
+    """Raised by analyze_transcription() when the API health probe fails; reason is the probe's message."""
+    
+    def __init__(self, reason):
+        super().__init__(f"Could not connect to the OpenAI API: {reason}")
+        self.reason = reason
+
+@dataclass
+class AnalysisOutcome:
+    """Result of analyze_transcription()."""
+    reports: dict  # result key -> Markdown report, or an error report if that model failed
+    failures: dict = field(default_factory=dict)  # result key -> error message
+    fields: ClinicalFields = None  # with structured=True, unless the extraction failed
+
+def analyze_transcription(client, transcription, patient_id, patient_name, models=ANALYSIS_MODELS, structured=False,
+                          requester=None, report=None):
+    """
+    Generate clinical reports for a transcript without any Streamlit calls.
+    The one implementation behind background jobs, batch runs and
+    generate_ai_analysis().
+    
+    Long transcripts are condensed segment by segment first. Reports already
+    in the LLM cache are used as they are; the others are requested
+    concurrently on the AI thread pool.
+    
+    Args:
+        client: OpenAI client
+        models: (result key, model, label) entries to generate
+        structured: Also extract the ClinicalFields of the conversation
+        requester: Session, job or batch the requests are rate limited for
+        report: Optional callback(progress, message, partial reports); the
+            completions are then streamed and the text written so far is
+            passed on about four times a second
+    
+    Raises:
+        ApiUnreachableError: If the API cannot be reached and a report is not cached
+    """
+    source_text, source_label = condense_transcript(
+        client, transcription, requester=requester,
+        on_progress=(lambda done, total: report(0.0, f"Summarized {done} of {total} parts of a long conversation")) if report else None
+    )
+    prompt = build_analysis_prompt(source_text, patient_id, patient_name, source_label=source_label)
+    fields_future = None
+    if structured:
+        fields_future = get_ai_executor().submit(request_clinical_fields, client, source_text, source_label, requester)
+    
+    results = {key: llm_cache_get(llm_cache_key(model, prompt)) for key, model, label in models}
+    missing = [(key, model, label) for key, model, label in models if results[key] is None]
+    if missing:
+        connected, error_message = get_api_health_probe().check(client.api_key)
+        if not connected:
+            raise ApiUnreachableError(error_message)
+    
+    streamed = {key: "" for key in results}
+    streamed_lock = threading.Lock()
+    
+    def on_delta(key, text):
+        with streamed_lock:
+            streamed[key] += text
+    
+    futures = {
+        get_ai_executor().submit(
+            request_analysis, client, model, prompt, (lambda text, key=key: on_delta(key, text)) if report else None, requester
+        ): (key, model, label)
+        for key, model, label in missing
+    }
+    outcome = AnalysisOutcome(reports=results)
+    pending = set(futures)
+    while pending:
+        done, pending = wait(pending, timeout=0.25, return_when=FIRST_COMPLETED)
+        for future in done:
+            key, model, label = futures[future]
+            try:
+                results[key] = future.result()
+                llm_cache_put(llm_cache_key(model, prompt), model, results[key])
+            except Exception as model_error:
+                results[key] = analysis_error_report(label, model_error)
+                outcome.failures[key] = str(model_error)
+        
+        if report:
+            finished = sum(text is not None for text in results.values())
+            with streamed_lock:
+                partial = {key: results[key] if results[key] is not None else streamed[key] for key in results}
+            report(finished / len(results), f"{finished} of {len(results)} analyses finished", partial)
+    
+    if fields_future:
+        try:
+            outcome.fields = fields_future.result()
+        except Exception as e:
+            print(f"Clinical field extraction failed for patient {patient_id}: {e}")
+    return outcome
+
 def record_audio_chunk(filename, duration=10):
     """Record audio in chunks"""
     # Check if PyAudio is available
@@ -4034,6 +5681,45 @@ def combine_audio_files(chunk_files, output_file):
         print(f"Error combining audio files: {e}")
         return False
 
+# Transcription cache
+def transcription_cache_get(audio_sha256, model, language=""):
+    """Return the stored transcript for this audio, model and language, or None; the hit is recorded by get_cache_usage()."""
+    key = (audio_sha256, model, language)
+    row = get_db_pool().query_one(
+        "SELECT transcript FROM transcription_cache WHERE audio_sha256 = ? AND model = ? AND language = ?", key
+    )
+    get_cache_usage().record("transcription", row is not None, key)
+    return row[0] if row else None
+
+def transcription_cache_put(audio_sha256, model, language, transcript):
+    """Store a transcript for this audio, model and language."""
+    get_db_pool().execute(
+        "INSERT OR REPLACE INTO transcription_cache (audio_sha256, model, language, transcript) VALUES (?, ?, ?, ?)",
+        (audio_sha256, model, language, transcript)
+    )
+
+def cached_transcription(audio_bytes, model, language, transcribe):
+    """
+    Transcribe audio at most once per (content, model, language).
+    
+    Args:
+        audio_bytes: The audio file's bytes
+        model: Transcription model, e.g. "whisper-1"
+        language: ISO language passed to the model, or "" for auto-detect
+        transcribe: Callable returning the transcript; only called on a cache miss
+    
+    Returns:
+        (transcript, True if it came from the cache)
+    """
+    audio_sha256 = hashlib.sha256(audio_bytes).hexdigest()
+    transcript = transcription_cache_get(audio_sha256, model, language)
+    if transcript is not None:
+        return transcript, True
+    
+    transcript = transcribe()
+    transcription_cache_put(audio_sha256, model, language, transcript)
+    return transcript, False
+
 def transcribe_audio(audio_file_path):
     """
     Transcribes audio using OpenAI's Whisper API.
@@ -4060,32 +5746,572 @@ def transcribe_audio(audio_file_path):
     
     try:
         # Initialize OpenAI client
-        client = OpenAI(api_key=st.session_state.openai_api_key)
+        client = get_openai_client(st.session_state.openai_api_key)
         
-        # Use the audio file with Whisper API
-        with open(audio_file_path, 'rb') as audio_file:
-            transcription_response = client.audio.transcriptions.create(
-                model="whisper-1",
-                file=audio_file,
-                language="en"
-            )
-            
-            transcript = transcription_response.text
+        # Upload only the speech, as 16 kHz mono, in parallel chunks if long
+        result = transcribe_recording(client, audio_file_path, requester=requester_id())
+        if result:
+            transcript, removed_seconds = result
+            if removed_seconds >= 1:
+                st.info(f"Removed {removed_seconds:.1f} seconds of silence before transcription.")
+        else:
+            with open(audio_file_path, 'rb') as audio_file:
+                audio_bytes = audio_file.read()
             
-            # Check if transcription returned minimal or repeated text
-            transcript_words = transcript.lower().split()
-            unique_words = set(transcript_words)
+            # Use the audio file with Whisper API, unless this exact audio was transcribed before
+            transcript = transcribe_chunk(client, audio_bytes, os.path.basename(audio_file_path), requester=requester_id())
+        
+        # Check if transcription returned minimal or repeated text
+        transcript_words = transcript.lower().split()
+        unique_words = set(transcript_words)
+        
+        if len(transcript_words) < 10 or len(unique_words) < 5:
+            st.warning("Transcription quality is poor. Using simulated conversation instead.")
+            return get_mock_dental_conversation()
             
-            if len(transcript_words) < 10 or len(unique_words) < 5:
-                st.warning("Transcription quality is poor. Using simulated conversation instead.")
-                return get_mock_dental_conversation()
-                
-            return transcript
+        return transcript
     except Exception as e:
         st.error(f"Error transcribing audio with OpenAI: {str(e)}")
         st.info("Using simulated transcription instead.")
         return get_mock_dental_conversation()
 
+# Long recording transcription
+# Recordings longer than this are split at pauses and transcribed in parallel
+LONG_AUDIO_SECONDS = 90
+# When trimming would keep less than this share of a recording, the VAD is
+# more likely wrong than the recording silent, so it is uploaded untrimmed
+MIN_SPEECH_FRACTION = 0.1
+
+def read_wav(path):
+    """
+    Read an 8, 16, 24 or 32-bit PCM WAV file as 16-bit samples.
+    
+    Returns:
+        (int16 array of shape (frames, channels), sample rate)
+    """
+    with wave.open(path, 'rb') as w:
+        width, channels = w.getsampwidth(), w.getnchannels()
+        frames = w.readframes(w.getnframes())
+        sample_rate = w.getframerate()
+    
+    if width == 1:
+        samples = (np.frombuffer(frames, dtype=np.uint8).astype(np.int16) - 128) << 8
+    elif width == 2:
+        samples = np.frombuffer(frames, dtype='<i2')
+    elif width == 3:
+        # Keep the two most significant bytes of each little-endian sample
+        samples = np.frombuffer(frames, dtype=np.uint8).reshape(-1, 3)[:, 1:].copy().view('<i2').ravel()
+    elif width == 4:
+        samples = (np.frombuffer(frames, dtype='<i4') >> 16).astype(np.int16)
+    else:
+        raise ValueError(f"Unsupported WAV sample width: {8 * width}-bit")
+    return samples.reshape(-1, channels), sample_rate
+
+def wav_bytes(samples, sample_rate):
+    """Encode an int16 array of shape (frames, channels) as WAV file bytes."""
+    buffer = BytesIO()
+    with wave.open(buffer, 'wb') as w:
+        w.setnchannels(samples.shape[1])
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes(np.ascontiguousarray(samples, dtype='<i2').tobytes())
+    return buffer.getvalue()
+
+def frame_energy(samples, sample_rate, frame_ms=30):
+    """RMS energy of consecutive frame_ms frames of the downmixed signal."""
+    frame = max(1, int(sample_rate * frame_ms / 1000))
+    mono = samples.astype(np.float32).mean(axis=1)
+    frames = mono[:len(mono) // frame * frame].reshape(-1, frame)
+    return np.sqrt(np.mean(frames ** 2, axis=1)), frame
+
+def split_at_silence(samples, sample_rate, max_seconds=60, min_seconds=30):
+    """
+    Split a recording into chunks of at most max_seconds, cutting each one at
+    the quietest 30 ms frame between min_seconds and max_seconds so words are
+    not cut in half.
+    
+    Returns:
+        List of (start, end) sample indices covering the whole recording
+    """
+    energy, frame = frame_energy(samples, sample_rate)
+    min_frames = int(min_seconds * sample_rate / frame)
+    max_frames = int(max_seconds * sample_rate / frame)
+    
+    spans = []
+    start = 0
+    while len(energy) - start > max_frames:
+        window = energy[start + min_frames:start + max_frames]
+        cut = start + min_frames + int(np.argmin(window))
+        spans.append((start * frame, cut * frame))
+        start = cut
+    spans.append((start * frame, len(samples)))
+    return spans
+
+def speech_mask(samples, sample_rate, frame_ms=30, min_silence_ms=500, pad_ms=150):
+    """
+    Voice activity per frame_ms frame, from frame energy and zero-crossing rate.
+    
+    Thresholds are relative to the recording itself: between its noise floor
+    (10th percentile of frame energy) and its loud frames (95th percentile).
+    A frame is speech when its energy is a fifth of the way from the floor to
+    the loud frames, or a tenth of the way with a high zero-crossing rate as
+    in unvoiced consonants like "s" and "f". A recording whose loud frames are
+    within 1.5x of its floor has no quiet stretches to tell apart and is all
+    speech. Pauses shorter than min_silence_ms count as speech and pad_ms is
+    kept either side of speech, so words and natural pauses are left alone.
+    
+    Returns:
+        (boolean array, one entry per frame; frame length in samples)
+    """
+    energy, frame = frame_energy(samples, sample_rate, frame_ms)
+    if not len(energy):
+        return np.zeros(0, dtype=bool), frame
+    
+    mono = samples[:len(energy) * frame].astype(np.float32).mean(axis=1).reshape(-1, frame)
+    zero_crossings = np.mean(np.diff(np.signbit(mono), axis=1), axis=1)
+    noise_floor = np.percentile(energy, 10)
+    loud = np.percentile(energy, 95)
+    if loud <= noise_floor * 1.5:
+        return np.ones(len(energy), dtype=bool), frame
+    voiced = energy > noise_floor + 0.2 * (loud - noise_floor)
+    unvoiced = (energy > noise_floor + 0.1 * (loud - noise_floor)) & (zero_crossings > 0.3)
+    speech = voiced | unvoiced
+    
+    # Pad speech on both sides, then fill the pauses that are too short to remove
+    pad = int(pad_ms / frame_ms)
+    if pad:
+        speech = np.convolve(speech, np.ones(2 * pad + 1), mode='same') > 0
+    edges = np.flatnonzero(np.diff(np.concatenate(([1], speech.astype(np.int8), [1]))))
+    for start, end in zip(edges[::2], edges[1::2]):
+        if 0 < start and end < len(speech) and (end - start) * frame_ms < min_silence_ms:
+            speech[start:end] = True
+    return speech, frame
+
+def trim_silence(samples, sample_rate, **vad_options):
+    """
+    Drop the silent stretches found by speech_mask().
+    
+    Returns:
+        (trimmed samples, offsets) where offsets is an array of
+        (trimmed start, original start) sample indices for each kept segment,
+        for mapping positions back to the original recording
+    """
+    speech, frame = speech_mask(samples, sample_rate, **vad_options)
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], speech.astype(np.int8), [0]))))
+    segments = [(start * frame, end * frame) for start, end in zip(edges[::2], edges[1::2])]
+    # The tail shorter than one frame goes with the last frame
+    if segments and segments[-1][1] == len(speech) * frame:
+        segments[-1] = (segments[-1][0], len(samples))
+    if not segments:
+        return samples[:0], np.zeros((0, 2), dtype=np.int64)
+    
+    lengths = np.array([end - start for start, end in segments])
+    offsets = np.column_stack((np.concatenate(([0], np.cumsum(lengths)[:-1])), [start for start, end in segments]))
+    trimmed = np.concatenate([samples[start:end] for start, end in segments])
+    return trimmed, offsets
+
+def original_position(offsets, index):
+    """Map a sample index in trimmed audio back to the original recording."""
+    if offsets is None or not len(offsets):
+        return index
+    segment = max(int(np.searchsorted(offsets[:, 0], index, side='right')) - 1, 0)
+    return int(offsets[segment, 1] + index - offsets[segment, 0])
+
+def transcribe_chunk(client, audio, name, language="en", requester=None):
+    """
+    Transcribe one chunk of audio bytes through the OpenAI rate limiter and
+    circuit breaker. The client retries failed uploads with exponential backoff.
+    """
+    options = {"language": language} if language else {}
+    transcript, _ = cached_transcription(
+        audio, "whisper-1", language,
+        lambda: call_openai(client.audio.transcriptions.create, "whisper-1", requester=requester, file=(name, audio), **options).text
+    )
+    return transcript
+
+def format_timestamp(seconds):
+    """Format seconds as [h:]mm:ss."""
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes:02d}:{seconds:02d}"
+
+def transcribe_long_audio(client, samples, sample_rate, offsets=None, language="en", max_workers=4, max_chunk_seconds=60,
+                          on_progress=None, requester=None):
+    """
+    Transcribe a long recording in parallel chunks.
+    
+    The recording is split at pauses into chunks of at most max_chunk_seconds,
+    which keeps every upload well under Whisper's size limit. Chunks are
+    transcribed by a bounded worker pool, each retried on its own, and
+    stitched back in order behind [mm:ss] start times. A chunk that still
+    fails is marked in the text instead of failing the whole transcript.
+    
+    Args:
+        client: OpenAI client
+        samples: int16 array of shape (frames, channels)
+        sample_rate: Sample rate of samples
+        offsets: Segment offsets from trim_silence(), so start times refer to
+            the original recording rather than the trimmed one
+        language: ISO language for Whisper, or "" to auto-detect
+        max_workers: Maximum concurrent uploads for this recording
+        max_chunk_seconds: Maximum chunk length
+        on_progress: Optional callback(chunks done, total chunks), called as
+            each chunk finishes
+        requester: Session or job the uploads are rate limited on behalf of
+    
+    Returns:
+        The timestamped transcript
+    """
+    spans = split_at_silence(samples, sample_rate, max_seconds=max_chunk_seconds, min_seconds=max_chunk_seconds / 2)
+    
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="dentai-whisper") as executor:
+        futures = [
+            executor.submit(transcribe_chunk, client, wav_bytes(samples[start:end], sample_rate), f"chunk_{i}.wav", language, requester)
+            for i, (start, end) in enumerate(spans)
+        ]
+        if on_progress:
+            for done, _ in enumerate(as_completed(futures), 1):
+                on_progress(done, len(futures))
+    
+    lines = []
+    for (start, end), future in zip(spans, futures):
+        try:
+            text = future.result().strip()
+        except Exception as e:
+            text = f"[transcription failed for this segment: {e}]"
+        lines.append(f"[{format_timestamp(original_position(offsets, start) / sample_rate)}] {text}")
+    return "\n".join(lines)
+
+# Audio normalization
+# Whisper works on 16 kHz mono internally, so anything more only adds upload bytes
+TRANSCRIPTION_SAMPLE_RATE = 16000
+
+def resample(samples, sample_rate, target_rate=TRANSCRIPTION_SAMPLE_RATE, taps=63):
+    """
+    Downmix int16 samples of shape (frames, channels) to mono and resample
+    to target_rate.
+    
+    When downsampling, a windowed-sinc low-pass at the new Nyquist frequency
+    is applied first so high frequencies do not alias into the speech band,
+    then samples are linearly interpolated at the new rate.
+    
+    Returns:
+        int16 array of shape (frames, 1)
+    """
+    mono = samples.astype(np.float32).mean(axis=1)
+    if sample_rate != target_rate and len(mono):
+        if target_rate < sample_rate:
+            cutoff = target_rate / sample_rate / 2
+            n = np.arange(taps) - (taps - 1) / 2
+            kernel = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(taps)
+            mono = np.convolve(mono, kernel / kernel.sum(), mode='same')
+        length = int(len(mono) * target_rate / sample_rate)
+        mono = np.interp(np.arange(length) * (sample_rate / target_rate), np.arange(len(mono)), mono)
+    return np.clip(np.round(mono), -32768, 32767).astype(np.int16)[:, None]
+
+def decode_with_ffmpeg(path, target_rate=TRANSCRIPTION_SAMPLE_RATE):
+    """
+    Decode any audio file ffmpeg understands (webm, mp3, m4a...) straight to
+    mono 16-bit PCM at target_rate.
+    
+    Returns:
+        int16 array of shape (frames, 1), or None if ffmpeg is not installed
+        or cannot decode the file
+    """
+    if not shutil.which("ffmpeg"):
+        return None
+    try:
+        result = subprocess.run(
+            ["ffmpeg", "-nostdin", "-v", "error", "-i", path, "-ac", "1", "-ar", str(target_rate), "-f", "s16le", "-"],
+            capture_output=True, timeout=300, check=True
+        )
+    except (subprocess.SubprocessError, OSError):
+        return None
+    return np.frombuffer(result.stdout, dtype='<i2').reshape(-1, 1)
+
+def load_audio(path):
+    """
+    Load a recording as 16 kHz mono 16-bit PCM for transcription.
+    
+    WAV files are decoded and resampled with NumPy; other formats, including
+    browser recordings saved as webm, go through ffmpeg when it is available.
+    
+    Returns:
+        int16 array of shape (frames, 1), or None if the file cannot be decoded
+    """
+    try:
+        samples, sample_rate = read_wav(path)
+    except (wave.Error, ValueError, EOFError):
+        return decode_with_ffmpeg(path)
+    return resample(samples, sample_rate)
+
+def transcribe_recording(client, audio_file_path, language="en", on_progress=None, requester=None):
+    """
+    Normalize a recording to 16 kHz mono, trim silence and transcribe what
+    is left, in parallel chunks when it is longer than LONG_AUDIO_SECONDS.
+    
+    on_progress and requester are passed on to transcribe_long_audio().
+    If trimming would keep less than MIN_SPEECH_FRACTION of the recording,
+    the normalized recording is transcribed untrimmed instead.
+    
+    Returns:
+        (transcript, seconds of silence removed), or None when the file
+        cannot be decoded and must be uploaded as it is
+    """
+    samples = load_audio(audio_file_path)
+    if samples is None:
+        return None
+    sample_rate = TRANSCRIPTION_SAMPLE_RATE
+    
+    speech, offsets = trim_silence(samples, sample_rate)
+    if len(speech) < MIN_SPEECH_FRACTION * len(samples):
+        speech, offsets = samples, None
+    removed_seconds = (len(samples) - len(speech)) / sample_rate
+    
+    if len(speech) / sample_rate > LONG_AUDIO_SECONDS:
+        transcript = transcribe_long_audio(
+            client, speech, sample_rate, offsets, language=language, on_progress=on_progress, requester=requester
+        )
+    else:
+        transcript = transcribe_chunk(client, wav_bytes(speech, sample_rate), os.path.basename(audio_file_path), language, requester)
+    return transcript, removed_seconds
+
+# Background jobs
+JOB_WORKERS = 2
+# How often a page with unfinished jobs reruns to show their progress, and
+# how often while an analysis is streaming its reports
+JOB_POLL_SECONDS = 2
+JOB_STREAM_POLL_SECONDS = 0.3
+
+@dataclass
+class Job:
+    """One row of the jobs table, with payload and result decoded."""
+    id: int
+    kind: str
+    patient_id: int
+    status: str
+    progress: float
+    message: str
+    payload: dict
+    result: dict
+    error: str
+    created_at: str
+    finished_at: str
+    
+    @property
+    def active(self):
+        return self.status in ("queued", "running")
+
+JOB_COLUMNS = "id, kind, patient_id, status, progress, message, payload, result, error, created_at, finished_at"
+
+def job_from_row(row):
+    values = list(row)
+    values[6] = json.loads(values[6]) if values[6] else {}
+    values[7] = json.loads(values[7]) if values[7] else None
+    return Job(*values)
+
+class JobQueue:
+    """
+    SQLite-backed queue of transcription and analysis jobs run by a small
+    pool of worker threads, so the script thread only submits and polls.
+    
+    Jobs, their progress and their results live in the jobs table and survive
+    a restart: jobs that were running when the process stopped are queued
+    again on startup. API keys are only ever held in memory, so a job
+    interrupted by a restart waits until a session with a key resumes it.
+    
+    Partial results reported while a job runs (the report text streamed so
+    far) are also kept in memory only, and get() and latest() return them in
+    place of the stored result. The jobs table only receives progress
+    messages when they change, and the final result.
+    """
+    
+    def __init__(self, pool, handlers, workers=JOB_WORKERS):
+        self.pool = pool
+        self.handlers = handlers
+        self._keys = {}  # job id -> API key, never written to the database
+        self._live = {}  # running job id -> (progress, message, partial result)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        
+        with pool.transaction() as conn:
+            conn.execute("UPDATE jobs SET status = 'queued', message = 'Interrupted by a restart' WHERE status = 'running'")
+        for i in range(workers):
+            threading.Thread(target=self._work, name=f"dentai-job-{i}", daemon=True).start()
+    
+    def submit(self, kind, patient_id, payload, api_key):
+        """Queue a job and return its id."""
+        cursor = self.pool.execute(
+            "INSERT INTO jobs (kind, patient_id, payload, message) VALUES (?, ?, ?, 'Waiting for a worker')",
+            (kind, patient_id, json.dumps(payload))
+        )
+        self.resume(cursor.lastrowid, api_key)
+        return cursor.lastrowid
+    
+    def resume(self, job_id, api_key):
+        """Give a queued job the API key it needs to run."""
+        with self._lock:
+            self._keys[job_id] = api_key
+        self._wake.set()
+    
+    def waiting_for_key(self, job_id):
+        """True if job_id cannot run until resume() gives it a key again."""
+        with self._lock:
+            return job_id not in self._keys
+    
+    def get(self, job_id):
+        row = self.pool.query_one(f"SELECT {JOB_COLUMNS} FROM jobs WHERE id = ?", (job_id,))
+        return self._with_live_state(job_from_row(row)) if row else None
+    
+    def latest(self, kind, patient_id):
+        """The most recent job of this kind for the patient, or None."""
+        row = self.pool.query_one(
+            f"SELECT {JOB_COLUMNS} FROM jobs WHERE patient_id = ? AND kind = ? ORDER BY id DESC LIMIT 1",
+            (patient_id, kind)
+        )
+        return self._with_live_state(job_from_row(row)) if row else None
+    
+    def _with_live_state(self, job):
+        """Overlay the in-memory progress and partial result of a job running in this process."""
+        with self._lock:
+            live = self._live.get(job.id)
+        if live and job.status == "running":
+            job.progress, job.message = live[0], live[1]
+            if live[2] is not None:
+                job.result = live[2]
+        return job
+    
+    def _update(self, job_id, progress, message, result=None):
+        with self._lock:
+            previous = self._live.get(job_id)
+            self._live[job_id] = (progress, message, result if result is not None else (previous[2] if previous else None))
+        if previous is None or previous[1] != message:
+            self.pool.execute("UPDATE jobs SET progress = ?, message = ? WHERE id = ?", (progress, message, job_id))
+    
+    def _claim(self):
+        """Mark the oldest runnable queued job as running and return it with its key."""
+        with self._lock:
+            runnable = list(self._keys)
+        if not runnable:
+            return None, None
+        
+        with self.pool.transaction() as conn:
+            row = conn.execute(
+                f"SELECT {JOB_COLUMNS} FROM jobs WHERE status = 'queued' "
+                f"AND id IN ({', '.join('?' * len(runnable))}) ORDER BY id LIMIT 1",
+                runnable
+            ).fetchone()
+            if row is None:
+                return None, None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', message = 'Started', started_at = CURRENT_TIMESTAMP, "
+                "attempts = attempts + 1 WHERE id = ?",
+                (row[0],)
+            )
+        with self._lock:
+            return job_from_row(row), self._keys.get(row[0])
+    
+    def _work(self):
+        while True:
+            try:
+                job, api_key = self._claim()
+            except sqlite3.Error as e:
+                print(f"Job queue error: {e}")
+                job = None
+            if job is None:
+                self._wake.wait(timeout=5)
+                self._wake.clear()
+                continue
+            
+            def report(progress, message, result=None, job_id=job.id):
+                self._update(job_id, progress, message, result)
+            
+            try:
+                result = self.handlers[job.kind](job, api_key, report)
+                self.pool.execute(
+                    "UPDATE jobs SET status = 'done', progress = 1, message = 'Finished', result = ?, "
+                    "finished_at = CURRENT_TIMESTAMP WHERE id = ?",
+                    (json.dumps(result), job.id)
+                )
+            except Exception as e:
+                self.pool.execute(
+                    "UPDATE jobs SET status = 'failed', message = 'Failed', error = ?, finished_at = CURRENT_TIMESTAMP WHERE id = ?",
+                    (str(e), job.id)
+                )
+            finally:
+                with self._lock:
+                    self._keys.pop(job.id, None)
+                    self._live.pop(job.id, None)
+
+def run_transcription_job(job, api_key, report):
+    """
+    Transcribe an uploaded recording and save the transcript to the
+    patient's clinical record.
+    """
+    client = get_openai_client(api_key)
+    audio_file_path = job.payload["audio_file_path"]
+    language = job.payload.get("language", "")
+    requester = job.payload.get("requester", f"job-{job.id}")
+    
+    report(0.05, "Preparing audio")
+    result = transcribe_recording(
+        client, audio_file_path, language,
+        on_progress=lambda done, total: report(0.1 + 0.8 * done / total, f"Transcribed {done} of {total} segments"),
+        requester=requester
+    )
+    if result:
+        transcription, removed_seconds = result
+    else:
+        # Formats that cannot be decoded here are uploaded as they are
+        with open(audio_file_path, 'rb') as audio_file:
+            transcription = transcribe_chunk(client, audio_file.read(), os.path.basename(audio_file_path), language, requester)
+        removed_seconds = 0
+    
+    # Never replace a saved transcript with nothing
+    if not transcription.strip():
+        raise RuntimeError("No speech was recognized in the recording. The saved transcription was left unchanged.")
+    
+    report(0.95, "Saving transcription")
+    save_clinical_record(job.patient_id, transcription=transcription, audio_file_path=audio_file_path)
+    return {"transcription": transcription, "removed_seconds": removed_seconds}
+
+def run_analysis_job(job, api_key, report):
+    """
+    Generate the GPT-3.5 and GPT-4 reports for a transcript with
+    analyze_transcription(), publishing the text written so far with each
+    progress update so the UI can show it while polling.
+    
+    With "structured" in the payload, the ClinicalFields of the conversation
+    are extracted alongside the reports and saved to the clinical record.
+    """
+    structured = bool(job.payload.get("structured"))
+    outcome = analyze_transcription(
+        get_openai_client(api_key), job.payload["transcription"], job.patient_id, job.payload["patient_name"],
+        structured=structured, requester=job.payload.get("requester", f"job-{job.id}"), report=report
+    )
+    results = dict(outcome.reports)
+    if structured:
+        if outcome.fields:
+            # The record the clinical page saves this patient's transcription and analysis to
+            row = get_db_pool().query_one(
+                "SELECT id FROM clinical_records WHERE patient_id = ? ORDER BY id LIMIT 1", (job.patient_id,)
+            )
+            record_id = row[0] if row else save_clinical_record(job.patient_id, transcription=job.payload["transcription"])
+            save_clinical_fields(record_id, outcome.fields, CLINICAL_EXTRACTION_MODEL)
+        results["fields"] = asdict(outcome.fields) if outcome.fields else None
+    return results
+
+JOB_HANDLERS = {
+    "transcription": run_transcription_job,
+    "analysis": run_analysis_job,
+}
+
+@st.cache_resource
+def get_job_queue():
+    """Return the job queue and workers shared by all sessions in this process."""
+    init_db()
+    return JobQueue(get_db_pool(), JOB_HANDLERS)
+
 def get_mock_dental_conversation():
     """Generate a realistic mock dental conversation"""
     conversations = [
@@ -4318,14 +6544,12 @@ def record_browser_audio(patient_id):
         
         return None, None
 
-def use_simulated_audio_mode(patient_id, conn, c):
+def use_simulated_audio_mode(patient_id):
     """
     Provides a simulated audio recording and transcription experience for testing without requiring a microphone
     
     Args:
         patient_id: ID of the patient for file naming
-        conn: Database connection
-        c: Database cursor
         
     Returns:
         Boolean indicating if a transcription was successfully generated
@@ -4390,20 +6614,8 @@ def use_simulated_audio_mode(patient_id, conn, c):
         
         # Save simulated transcription to database
         try:
-            # Check if a record already exists for this patient
-            c.execute("SELECT id FROM clinical_records WHERE patient_id = ?", (patient_id,))
-            existing_id = c.fetchone()
-            
-            if existing_id:
-                # Update existing record
-                c.execute("UPDATE clinical_records SET transcription = ?, record_date = CURRENT_TIMESTAMP WHERE id = ?", 
-                        (mock_data, existing_id[0]))
-            else:
-                # Insert new record
-                c.execute("INSERT INTO clinical_records (patient_id, transcription, record_date) VALUES (?, ?, CURRENT_TIMESTAMP)",
-                        (patient_id, mock_data))
+            save_clinical_record(patient_id, touch_date=True, transcription=mock_data)
             
-            conn.commit()
             st.success("✅ Simulated transcription saved successfully!")
             st.info("Go to the AI Analysis tab to generate clinical insights.")
             return True
@@ -1,5 +1,7 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from io import BytesIO
 import base64
 
@@ -8,6 +10,27 @@ st.title("Audio Recorder and Transcription with Whisper API")
 # API Key input for OpenAI
 api_key = st.text_input("Enter your OpenAI API key", type="password")
 
+@st.cache_resource
+def get_http_session():
+    """
+    HTTP session shared by all sessions in this process.
+    
+    Keeps connections to the API alive between requests and retries
+    connection errors, 429 and 5xx responses with exponential backoff,
+    honouring Retry-After.
+    """
+    retry = Retry(
+        total=4,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=None,
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry))
+    return session
+
 # Function to transcribe audio using OpenAI's Whisper API
 def transcribe_audio(audio_file, api_key):
     headers = {
@@ -19,10 +42,11 @@ def transcribe_audio(audio_file, api_key):
         "model": (None, "whisper-1"),
     }
     
-    response = requests.post(
+    response = get_http_session().post(
         "https://api.openai.com/v1/audio/transcriptions",
         headers=headers,
-        files=files
+        files=files,
+        timeout=120
     )
     
     if response.status_code == 200: